@@ -1,41 +1,321 @@
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+import warnings
+import zipfile
+import zlib
 from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from functools import lru_cache, partial
 from io import BytesIO
+from itertools import accumulate, islice
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile, TemporaryFile, gettempdir
+from urllib.parse import parse_qs, urlsplit
+from typing import BinaryIO, Callable, NamedTuple
 from textwrap import dedent
 from email import policy
-from email.parser import BytesParser
+from email.parser import BytesHeaderParser
 
 HOST = "0.0.0.0"
 PORT = 8000
+HTTP_WORKERS = 16
+# Accepted connections allowed to wait for a free HTTP worker; beyond this,
+# new connections are answered with 503 straight away.
+HTTP_QUEUE = 64
+RENDER_SLOTS = 2
+RENDER_QUEUE = 6
+CACHE_DIR = os.path.join(gettempdir(), "rasterbator-cache")
+CACHE_DISK_MB = 1024
+CACHE_MEMORY_MB = 64
+SOURCE_CACHE_MB = 512
+JOB_WORKERS = 1
+JOB_TTL_SECONDS = 3600
+# Admission control: the largest poster a single request may ask for, the
+# memory all running renders may use together, and how many renders or
+# unfinished jobs one client may have at a time (0 for no per-client limit).
+MAX_RENDER_MEGAPIXELS = 1000
+RENDER_MEMORY_MB = 2048
+CLIENT_RENDERS = 0
+# ...and the CPU time a single render may be estimated to need.
+MAX_RENDER_SECONDS = 300
+# Sources of at least this many megapixels are decoded into a memory-mapped
+# temporary file (under TMPDIR) instead of into memory. Larger sources than
+# MAX_SOURCE_MEGAPIXELS are refused; `set_max_source_megapixels` changes the
+# limit and moves Pillow's decompression-bomb check along with it.
+MAP_SOURCE_MEGAPIXELS = 100
+MAX_SOURCE_MEGAPIXELS = 175
 
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+MAX_FIELD_BYTES = 64 * 1024
+# Uploads larger than this are spooled from memory to a temporary file.
+UPLOAD_SPOOL_BYTES = 1024 * 1024
+# Seconds a client may take to send a whole request body.
+UPLOAD_TIMEOUT_SECONDS = 300
 
-def parse_multipart_form(body: bytes, content_type: str):
-    """Parse a multipart/form-data body into fields and files.
+_READ_CHUNK = 64 * 1024
+_MAX_PART_HEADER_BYTES = 16 * 1024
+_PART_HEADER_PARSER = BytesHeaderParser(policy=policy.default)
+
+# Pipeline stages reported by `stage`, in pipeline order.
+RENDER_STAGES = ("parse", "decode", "resize", "tile", "encode")
+# Histogram bucket upper bounds for latencies (seconds) and upload sizes (bytes).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+UPLOAD_SIZE_BUCKETS = tuple(int(mb * 1024 * 1024) for mb in (0.1, 0.5, 1, 2, 5, 10, 25, 50, 100))
+
+_stage_state = threading.local()
+_NO_STAGE = nullcontext()
+
+
+class _StageTimer:
+    __slots__ = ("_timings", "_name", "_start")
+
+    def __init__(self, timings: dict, name: str) -> None:
+        self._timings = timings
+        self._name = name
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        elapsed = time.perf_counter() - self._start
+        self._timings[self._name] = self._timings.get(self._name, 0.0) + elapsed
+
+
+def stage(name: str):
+    """Return a context manager that times one pipeline stage.
+
+    Time is added to the recorder that `record_stages` set up on the current
+    thread. Without one this returns a shared no-op context manager, so the
+    instrumentation costs a thread-local lookup when nobody is listening.
+    """
+    timings = getattr(_stage_state, "timings", None)
+    if timings is None:
+        return _NO_STAGE
+    return _StageTimer(timings, name)
+
+
+def add_stage_time(name: str, seconds: float) -> None:
+    """Add time measured elsewhere, such as in a render process, to the current recorder."""
+    timings = getattr(_stage_state, "timings", None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def record_stages(timings: dict | None = None):
+    """Accumulate the seconds spent in each `stage` on this thread into a dict."""
+    previous = getattr(_stage_state, "timings", None)
+    _stage_state.timings = timings = {} if timings is None else timings
+    try:
+        yield timings
+    finally:
+        _stage_state.timings = previous
+
+
+def format_server_timing(timings: dict, total: float | None = None) -> str:
+    """Format stage timings as a Server-Timing header value in milliseconds."""
+    metrics = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    if total is not None:
+        metrics.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(metrics)
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when a request body exceeds the configured upload limit."""
+
+
+class UploadTimeoutError(ValueError):
+    """Raised when a request body is not received before its deadline."""
+
+
+class _MultipartReader:
+    """Incrementally split a multipart body read from a stream at its boundaries.
+
+    At most `content_length` bytes are read from `stream`, in chunks of
+    `_READ_CHUNK` bytes. Only a chunk plus the length of the delimiter is ever
+    buffered; part bodies are handed to a sink as they arrive. Past the
+    monotonic `deadline`, further reads raise `UploadTimeoutError`; each read
+    returns whatever has arrived, so a slow client is caught within one
+    socket timeout of it.
+    """
+
+    def __init__(self, stream: BinaryIO, content_length: int, boundary: bytes, deadline: float | None = None) -> None:
+        self._stream = stream
+        self._read = getattr(stream, "read1", stream.read)
+        self._deadline = deadline
+        self._remaining = content_length
+        # The leading CRLF lets the first boundary match the same delimiter as
+        # every later one.
+        self._buffer = bytearray(b"\r\n")
+        self._delimiter = b"\r\n--" + boundary
+        self._finished = False
+
+    def _fill(self) -> bool:
+        if self._remaining <= 0:
+            return False
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            raise UploadTimeoutError("Request body took too long to arrive.")
+        chunk = self._read(min(_READ_CHUNK, self._remaining))
+        if not chunk:
+            return False
+        self._remaining -= len(chunk)
+        self._buffer += chunk
+        return True
+
+    def _require(self, size: int) -> None:
+        while len(self._buffer) < size:
+            if not self._fill():
+                raise ValueError("Multipart body ended unexpectedly.")
+
+    def copy_part(self, sink, limit: int | None = None) -> int:
+        """Pass the current part's body to `sink` up to the next boundary and return its size."""
+        size = 0
+        keep = len(self._delimiter) - 1
+        while True:
+            index = self._buffer.find(self._delimiter)
+            end = index if index >= 0 else max(0, len(self._buffer) - keep)
+            if end:
+                size += end
+                if limit is not None and size > limit:
+                    raise UploadTooLargeError("Form field is too large.")
+                with memoryview(self._buffer) as view:
+                    sink(view[:end])
+                del self._buffer[:end]
+            if index >= 0:
+                del self._buffer[: len(self._delimiter)]
+                return size
+            if not self._fill():
+                raise ValueError("Multipart body ended before the closing boundary.")
+
+    def next_part(self) -> bool:
+        """Consume the rest of a boundary line and report whether another part follows."""
+        if self._finished:
+            return False
+        self._require(2)
+        if self._buffer[:2] == b"--":
+            self._finished = True
+            return False
+        line_end = self._buffer.find(b"\r\n")
+        while line_end < 0:
+            if len(self._buffer) > _MAX_PART_HEADER_BYTES or not self._fill():
+                raise ValueError("Malformed multipart boundary.")
+            line_end = self._buffer.find(b"\r\n")
+        # Anything between the boundary and CRLF is transport padding.
+        del self._buffer[: line_end + 2]
+        return True
+
+    def read_headers(self):
+        """Read and parse the header block of the current part."""
+        if self._buffer[:2] == b"\r\n":
+            del self._buffer[:2]
+            return _PART_HEADER_PARSER.parsebytes(b"")
+        end = self._buffer.find(b"\r\n\r\n")
+        while end < 0:
+            if len(self._buffer) > _MAX_PART_HEADER_BYTES or not self._fill():
+                raise ValueError("Malformed multipart part headers.")
+            end = self._buffer.find(b"\r\n\r\n")
+        headers = _PART_HEADER_PARSER.parsebytes(bytes(self._buffer[: end + 4]))
+        del self._buffer[: end + 4]
+        return headers
+
+
+def multipart_boundary(content_type: str) -> bytes:
+    """Extract the boundary parameter from a multipart Content-Type header."""
+    header = _PART_HEADER_PARSER.parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1"))
+    boundary = header.get_param("boundary")
+    if not boundary or len(boundary) > 70:
+        raise ValueError("Missing or invalid multipart boundary.")
+    return str(boundary).encode("latin-1")
+
+
+def parse_multipart_stream(
+    stream: BinaryIO,
+    content_type: str,
+    content_length: int,
+    max_upload_bytes: int = MAX_UPLOAD_BYTES,
+    timeout: float | None = None,
+):
+    """Parse a multipart/form-data body directly from a stream.
 
     Returns a tuple of (fields, files) where `fields` maps field names to text
-    values and `files` maps field names to a dict containing filename and
-    content bytes.
+    values and `files` maps field names to a dict containing the filename, the
+    part size, its SHA-256 hex digest and a `file` object positioned at the
+    start of the upload. Files
+    are spooled to disk once they exceed `UPLOAD_SPOOL_BYTES`; callers should
+    close them when done. Bodies longer than `max_upload_bytes` are rejected
+    with `UploadTooLargeError` before anything is read, and bodies that take
+    more than `timeout` seconds to arrive with `UploadTimeoutError`.
     """
+    if content_length > max_upload_bytes:
+        raise UploadTooLargeError(f"Upload exceeds the {max_upload_bytes // (1024 * 1024)} MB limit.")
 
-    # Prefix with a synthetic header block so BytesParser can understand the
-    # multipart payload.
-    parser = BytesParser(policy=policy.default)
-    message = parser.parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    with stage("parse"):
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        reader = _MultipartReader(stream, content_length, multipart_boundary(content_type), deadline)
+        fields = {}
+        files = {}
+        try:
+            reader.copy_part(lambda data: None)  # preamble
+            while reader.next_part():
+                headers = reader.read_headers()
+                name = headers.get_param("name", header="content-disposition")
+                filename = headers.get_param("filename", header="content-disposition")
 
-    fields = {}
-    files = {}
+                if headers.get_content_disposition() != "form-data" or name is None:
+                    reader.copy_part(lambda data: None)
+                elif filename:
+                    spool = SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+                    digest = hashlib.sha256()
+                    upload = files[name] = {"filename": filename, "file": spool, "size": 0}
 
-    for part in message.iter_parts():
-        if part.get_content_disposition() != "form-data":
-            continue
+                    def spool_chunk(data, spool=spool, digest=digest) -> None:
+                        digest.update(data)
+                        spool.write(data)
 
-        name = part.get_param("name", header="content-disposition")
-        filename = part.get_param("filename", header="content-disposition")
+                    upload["size"] = reader.copy_part(spool_chunk)
+                    upload["sha256"] = digest.hexdigest()
+                    spool.seek(0)
+                else:
+                    value = bytearray()
+                    reader.copy_part(value.extend, limit=MAX_FIELD_BYTES)
+                    charset = headers.get_content_charset() or "utf-8"
+                    fields[name] = value.decode(charset, errors="replace")
+        except Exception:
+            for upload in files.values():
+                upload["file"].close()
+            raise
 
-        if filename:
-            files[name] = {"filename": filename, "content": part.get_payload(decode=True)}
-        else:
-            fields[name] = part.get_content()
+    return fields, files
+
+
+def parse_multipart_form(body: bytes, content_type: str):
+    """Parse a multipart/form-data body into fields and files.
 
+    Returns a tuple of (fields, files) where `fields` maps field names to text
+    values and `files` maps field names to a dict containing filename and
+    content bytes.
+    """
+    fields, files = parse_multipart_stream(BytesIO(body), content_type, len(body), max_upload_bytes=len(body))
+    for upload in files.values():
+        with upload.pop("file") as spool:
+            upload["content"] = spool.read()
     return fields, files
 
 
@@ -399,13 +679,56 @@ def build_page() -> str:
                                     <option value=\"landscape\">Landscape</option>
                                 </select>
                             </label>
+                            <div style=\"display: grid; gap: 10px; grid-template-columns: repeat(auto-fit, minmax(140px, 1fr));\">
+                                <label style=\"display: grid; gap: 6px; font-weight: 600;\">
+                                    Style
+                                    <select name=\"style\" style=\"padding: 10px; border-radius: 10px; border: 1px solid #2c2c35; background: #111118; color: var(--text);\">
+                                        <option value=\"photo\" selected>Photo</option>
+                                        <option value=\"dots\">Halftone dots</option>
+                                        <option value=\"squares\">Pixel squares</option>
+                                        <option value=\"lines\">Line art</option>
+                                    </select>
+                                </label>
+                                <label style=\"display: grid; gap: 6px; font-weight: 600;\">
+                                    Dot size (mm)
+                                    <input type=\"number\" step=\"0.5\" name=\"cell_mm\" value=\"6\" min=\"1\" max=\"50\" style=\"padding: 10px; border-radius: 10px; border: 1px solid #2c2c35; background: #111118; color: var(--text);\" />
+                                </label>
+                            </div>
+                            <div style=\"display: grid; gap: 10px; grid-template-columns: repeat(auto-fit, minmax(140px, 1fr));\">
+                                <label style=\"display: grid; gap: 6px; font-weight: 600;\">
+                                    Compression
+                                    <select name=\"compression\" style=\"padding: 10px; border-radius: 10px; border: 1px solid #2c2c35; background: #111118; color: var(--text);\">
+                                        <option value=\"jpeg\" selected>JPEG</option>
+                                        <option value=\"flate\">Lossless</option>
+                                        <option value=\"passthrough\">Original JPEG when possible</option>
+                                    </select>
+                                </label>
+                                <label style=\"display: grid; gap: 6px; font-weight: 600;\">
+                                    JPEG quality
+                                    <input type=\"number\" name=\"quality\" value=\"75\" min=\"1\" max=\"95\" style=\"padding: 10px; border-radius: 10px; border: 1px solid #2c2c35; background: #111118; color: var(--text);\" />
+                                </label>
+                            </div>
+                            <label style=\"display: flex; gap: 8px; align-items: center; font-weight: 600;\">
+                                <input type=\"checkbox\" name=\"shared_image\" value=\"1\" />
+                                Smaller PDF: embed the photo once and let the printer scale it
+                            </label>
+                            <label style=\"display: grid; gap: 6px; font-weight: 600;\">
+                                Download as
+                                <select name=\"output_format\" style=\"padding: 10px; border-radius: 10px; border: 1px solid #2c2c35; background: #111118; color: var(--text);\">
+                                    <option value=\"pdf\" selected>PDF</option>
+                                    <option value=\"zip-png\">ZIP of PNG pages</option>
+                                    <option value=\"zip-jpeg\">ZIP of JPEG pages</option>
+                                    <option value=\"tiff\">Multi-page TIFF</option>
+                                </select>
+                            </label>
                             <p style=\"color: var(--muted); font-size: 14px; margin: 0;\">Submit to download a ready-to-print PDF. Each sheet will be a separate page in the PDF.</p>
                             <button class=\"btn btn-primary\" type=\"submit\">Generate PDF</button>
+                            <p id=\"job-status\" aria-live=\"polite\" style=\"color: var(--muted); font-size: 14px; margin: 0; min-height: 1.2em;\"></p>
                         </form>
                     </div>
                     <div class=\"card live-preview\">
                         <h3 style=\"margin-top: 0;\">Live preview</h3>
-                        <p class=\"preview-note\">See exactly how your image will split across pages. The grid updates instantly when you change columns, rows, margins, orientation, or page size.</p>
+                        <p class=\"preview-note\">See exactly how your image will split across pages. The grid updates instantly when you change columns, rows, margins, orientation, or page size, and is then redrawn by the same renderer that makes the PDF.</p>
                         <div id=\"preview-box\" class=\"preview-box\">
                             <canvas id=\"preview-canvas\" aria-label=\"Poster grid preview\"></canvas>
                             <div id=\"preview-placeholder\" class=\"preview-placeholder\">Upload an image to preview the cuts</div>
@@ -519,6 +842,8 @@ def build_page() -> str:
                     const placeholder = document.getElementById("preview-placeholder");
                     const gridLabel = document.getElementById("grid-label");
                     const pageLabel = document.getElementById("page-label");
+                    const submitButton = form.querySelector('button[type="submit"]');
+                    const jobStatus = document.getElementById("job-status");
 
                     const PAGE_SIZES = {
                         A4: [210, 297],
@@ -527,10 +852,16 @@ def build_page() -> str:
 
                     const DPI_MIN = 72;
                     const DPI_MAX = 600;
+                    const PREVIEW_FIELDS = ["columns", "rows", "margin", "dpi", "page_size", "orientation", "style", "cell_mm"];
 
                     let loadedImage = null;
                     let activeObjectUrl = null;
                     let dpiUserOverride = false;
+                    let previewImageId = null;
+                    let serverPreview = null;
+                    let pendingPreviewQuery = null;
+                    let previewRequest = 0;
+                    let previewTimer = null;
 
                     function clampNumber(value, fallback, min = 1) {
                         const num = Number.parseFloat(value);
@@ -559,6 +890,57 @@ def build_page() -> str:
                         return Math.min(DPI_MAX, Math.max(DPI_MIN, rawDpi));
                     }
 
+                    function previewQuery(size) {
+                        const data = new FormData(form);
+                        const params = new URLSearchParams({ image_id: previewImageId, size: `${size}` });
+                        PREVIEW_FIELDS.forEach((name) => {
+                            const value = data.get(name);
+                            if (typeof value === "string") params.set(name, value);
+                        });
+                        return params.toString();
+                    }
+
+                    // Fetch the server's rendering of the poster once the settings stop changing.
+                    function schedulePreview(query) {
+                        if (query === pendingPreviewQuery) return;
+                        clearTimeout(previewTimer);
+                        pendingPreviewQuery = query;
+                        previewTimer = setTimeout(async () => {
+                            const request = ++previewRequest;
+                            try {
+                                const response = await fetch(`/preview?${query}`);
+                                if (!response.ok) {
+                                    throw new Error(response.statusText || `HTTP ${response.status}`);
+                                }
+                                const image = await createImageBitmap(await response.blob());
+                                if (request === previewRequest) {
+                                    serverPreview = { query, image };
+                                    requestAnimationFrame(renderPreview);
+                                }
+                            } catch (error) {
+                                // Keep showing the local preview.
+                            } finally {
+                                if (request === previewRequest) pendingPreviewQuery = null;
+                            }
+                        }, 150);
+                    }
+
+                    async function uploadForPreview(file) {
+                        const body = new FormData();
+                        body.append("image", file);
+                        try {
+                            const response = await fetch("/images", { method: "POST", body });
+                            if (!response.ok) return;
+                            const { id } = await response.json();
+                            if ((fileInput.files || [])[0] === file) {
+                                previewImageId = id;
+                                renderPreview();
+                            }
+                        } catch (error) {
+                            // Without an image id the preview is drawn locally.
+                        }
+                    }
+
                     function renderPreview() {
                         const columns = clampNumber(columnsInput.value, 3);
                         const rows = clampNumber(rowsInput.value, 3);
@@ -662,6 +1044,20 @@ def build_page() -> str:
                         ctx.fillStyle = "#0f0f15";
                         ctx.fillRect(offsetX - 12, offsetY - 12, mosaicW + 24, mosaicH + 24);
 
+                        // Draw the server's preview when it matches the current settings. Until it
+                        // arrives, the tiles are drawn from the local image.
+                        let useServerPreview = false;
+                        if (previewImageId && window.createImageBitmap) {
+                            const size = Math.min(2048, Math.ceil(Math.max(mosaicW, mosaicH) * dpr / 128) * 128);
+                            const query = previewQuery(size);
+                            useServerPreview = serverPreview !== null && serverPreview.query === query;
+                            if (useServerPreview) {
+                                ctx.drawImage(serverPreview.image, offsetX, offsetY, mosaicW, mosaicH);
+                            } else {
+                                schedulePreview(query);
+                            }
+                        }
+
                         const startXmm = (totalW - drawWmm) / 2;
                         const startYmm = (totalH - drawHmm) / 2;
 
@@ -670,8 +1066,10 @@ def build_page() -> str:
                                 const pageX = offsetX + col * pageW * scaleToBox;
                                 const pageY = offsetY + row * pageH * scaleToBox;
 
-                                ctx.fillStyle = "#181822";
-                                ctx.fillRect(pageX, pageY, pageW * scaleToBox, pageH * scaleToBox);
+                                if (!useServerPreview) {
+                                    ctx.fillStyle = "#181822";
+                                    ctx.fillRect(pageX, pageY, pageW * scaleToBox, pageH * scaleToBox);
+                                }
 
                                 const tileStartXmm = col * pageW + margin;
                                 const tileStartYmm = row * pageH + margin;
@@ -683,7 +1081,7 @@ def build_page() -> str:
                                 const drawEndXmm = Math.min(tileEndXmm, startXmm + drawWmm);
                                 const drawEndYmm = Math.min(tileEndYmm, startYmm + drawHmm);
 
-                                if (drawEndXmm > drawStartXmm && drawEndYmm > drawStartYmm) {
+                                if (!useServerPreview && drawEndXmm > drawStartXmm && drawEndYmm > drawStartYmm) {
                                     const srcX = ((drawStartXmm - startXmm) / drawWmm) * (loadedImage.width / scaleToCoverPx);
                                     const srcY = ((drawStartYmm - startYmm) / drawHmm) * (loadedImage.height / scaleToCoverPx);
                                     const srcW = ((drawEndXmm - drawStartXmm) / drawWmm) * (loadedImage.width / scaleToCoverPx);
@@ -730,6 +1128,8 @@ def build_page() -> str:
 
                     fileInput.addEventListener("change", () => {
                         const [file] = fileInput.files || [];
+                        previewImageId = null;
+                        serverPreview = null;
                         if (!file) {
                             loadedImage = null;
                             dpiUserOverride = false;
@@ -763,17 +1163,65 @@ def build_page() -> str:
                             placeholder.textContent = "Preview failed to load. Try a different image.";
                         };
                         img.src = activeObjectUrl;
+                        if (window.fetch) {
+                            uploadForPreview(file);
+                        }
                     });
 
                     dpiInput.addEventListener("input", () => {
                         dpiUserOverride = true;
                     });
 
-                    [columnsInput, rowsInput, marginInput, dpiInput, pageSizeSelect, orientationSelect].forEach((input) => {
+                    const styleInputs = form.querySelectorAll('[name="style"], [name="cell_mm"]');
+                    [columnsInput, rowsInput, marginInput, dpiInput, pageSizeSelect, orientationSelect, ...styleInputs].forEach((input) => {
                         input.addEventListener("input", renderPreview);
                         input.addEventListener("change", renderPreview);
                     });
 
+                    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+                    async function waitForJob(job) {
+                        while (true) {
+                            const response = await fetch(job.status_url, { cache: "no-store" });
+                            if (!response.ok) {
+                                throw new Error(response.statusText || `HTTP ${response.status}`);
+                            }
+                            const state = await response.json();
+                            if (state.status === "done") {
+                                jobStatus.textContent = "Done! Your poster is downloading.";
+                                window.location.href = job.result_url;
+                                return;
+                            }
+                            if (state.status === "failed" || state.status === "cancelled") {
+                                throw new Error(state.error || `Job ${state.status}`);
+                            }
+                            jobStatus.textContent = state.status === "queued"
+                                ? "Waiting for a free renderer..."
+                                : `Rendering page ${state.pages_done} of ${state.pages_total}...`;
+                            await sleep(1000);
+                        }
+                    }
+
+                    form.addEventListener("submit", async (event) => {
+                        if (!window.fetch || !window.FormData) {
+                            return; // Fall back to the plain form submission.
+                        }
+                        event.preventDefault();
+                        submitButton.disabled = true;
+                        jobStatus.textContent = "Uploading...";
+                        try {
+                            const response = await fetch("/jobs", { method: "POST", body: new FormData(form) });
+                            if (!response.ok) {
+                                throw new Error(response.statusText || `HTTP ${response.status}`);
+                            }
+                            await waitForJob(await response.json());
+                        } catch (error) {
+                            jobStatus.textContent = `Could not generate the poster: ${error.message}`;
+                        } finally {
+                            submitButton.disabled = false;
+                        }
+                    });
+
                     window.addEventListener("resize", () => requestAnimationFrame(renderPreview));
                     if ("ResizeObserver" in window) {
                         const observer = new ResizeObserver(() => requestAnimationFrame(renderPreview));
@@ -789,6 +1237,68 @@ def build_page() -> str:
     )
 
 
+class StaticResponse(NamedTuple):
+    """A pre-encoded response body in every supported content coding."""
+
+    content_type: str
+    etag: str
+    variants: dict[str, bytes]
+
+    def etag_for(self, coding: str) -> str:
+        # Each coding is a distinct representation, so it gets its own strong validator.
+        return self.etag if coding == "identity" else f'{self.etag[:-1]}-{coding}"'
+
+
+def encode_static_response(body: bytes, content_type: str) -> StaticResponse:
+    """Pre-compress `body` with gzip and, when the module is installed, brotli."""
+    variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    try:
+        import brotli  # type: ignore
+    except ModuleNotFoundError:
+        pass
+    else:
+        variants["br"] = brotli.compress(body)
+    # Only keep encodings that actually make the body smaller.
+    variants = {coding: data for coding, data in variants.items() if coding == "identity" or len(data) < len(body)}
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    return StaticResponse(content_type, etag, variants)
+
+
+@lru_cache(maxsize=None)
+def landing_page() -> StaticResponse:
+    """Return the landing page, rendered and compressed once per process."""
+    return encode_static_response(build_page().encode("utf-8"), "text/html; charset=utf-8")
+
+
+def negotiate_encoding(accept_encoding: str, available) -> str:
+    """Pick the preferred content coding from an Accept-Encoding header."""
+    preferences = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        preferences[coding] = quality
+
+    # Identity is always acceptable and serves as the fallback.
+    best, best_quality = "identity", 0.0
+    for coding in ("br", "gzip"):
+        if coding not in available:
+            continue
+        quality = preferences.get(coding, preferences.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
 PAGE_SIZES_MM = {
     "A4": (210.0, 297.0),
     "Letter": (215.9, 279.4),
@@ -797,6 +1307,14 @@ PAGE_SIZES_MM = {
 DPI_MIN = 72
 DPI_MAX = 600
 
+HALFTONE_STYLES = ("dots", "squares", "lines")
+HALFTONE_CELL_MM = 6.0
+# Dot sizes the form accepts, and the most cells one poster may have. Every
+# cell is a mark drawn by Python code, so the cell count bounds the work.
+HALFTONE_CELL_MIN_MM = 1.0
+HALFTONE_CELL_MAX_MM = 50.0
+MAX_HALFTONE_CELLS = 4_000_000
+
 
 def mm_to_px(mm: float, dpi: int) -> int:
     return int(round(mm / 25.4 * dpi))
@@ -824,22 +1342,404 @@ def suggest_dpi(
     return max(DPI_MIN, min(DPI_MAX, raw_dpi))
 
 
-def rasterbate_image(
-    image_bytes: bytes,
+PDF_COMPRESSIONS = ("jpeg", "flate", "passthrough")
+JPEG_QUALITY = 75
+# Content type and file extension of each output format.
+OUTPUT_FORMATS = {
+    "pdf": ("application/pdf", ".pdf"),
+    "zip-png": ("application/zip", ".zip"),
+    "zip-jpeg": ("application/zip", ".zip"),
+    "tiff": ("image/tiff", ".tif"),
+}
+
+
+class PdfImage(NamedTuple):
+    """An encoded raster ready to be embedded as a PDF image XObject."""
+
+    data: bytes
+    width: int
+    height: int
+    color_space: str
+    filter: str
+    bits_per_component: int = 8
+    decode_parms: str | None = None
+
+
+def _png_image_data(image) -> bytes:
+    """Return the concatenated IDAT payload of `image` saved as a PNG.
+
+    That payload is a zlib stream of PNG-filtered rows, which PDF readers
+    decode with FlateDecode and a PNG predictor.
+    """
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=6)
+    data = buffer.getbuffer()
+    chunks = []
+    position = 8  # PNG signature
+    while position < len(data):
+        length, kind = struct.unpack_from(">I4s", data, position)
+        if kind == b"IDAT":
+            chunks.append(bytes(data[position + 8 : position + 8 + length]))
+        position += length + 12
+    return b"".join(chunks)
+
+
+def encode_pdf_image(image, compression: str = "jpeg", quality: int = JPEG_QUALITY) -> PdfImage:
+    """Encode a Pillow image as a stream suitable for PDF embedding.
+
+    "jpeg" produces a DCT stream at `quality`; "flate" is lossless, using
+    zlib with PNG row predictors. Any other value (including "passthrough",
+    which only applies to untouched source images) falls back to JPEG.
+    """
+    with stage("encode"):
+        if image.mode not in {"RGB", "L"}:
+            image = image.convert("RGB")
+        color_space = "DeviceRGB" if image.mode == "RGB" else "DeviceGray"
+        if compression == "flate":
+            colors = 3 if image.mode == "RGB" else 1
+            parms = f"<</Predictor 15 /Colors {colors} /BitsPerComponent 8 /Columns {image.width}>>"
+            data = _png_image_data(image)
+            return PdfImage(data, image.width, image.height, color_space, "FlateDecode", 8, parms)
+        buffer = BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        return PdfImage(buffer.getvalue(), image.width, image.height, color_space, "DCTDecode")
+
+
+def passthrough_pdf_image(encoded: bytes) -> PdfImage | None:
+    """Wrap an original JPEG file as a PDF image without re-encoding it.
+
+    Returns None when the data is not a baseline-compatible RGB or grayscale
+    JPEG that PDF readers can display as is.
+    """
+    try:
+        image = open_image(BytesIO(encoded))
+    except Exception:  # pylint: disable=broad-except
+        return None
+    if image.format != "JPEG" or image.mode not in {"RGB", "L"}:
+        return None
+    color_space = "DeviceRGB" if image.mode == "RGB" else "DeviceGray"
+    return PdfImage(bytes(encoded), image.width, image.height, color_space, "DCTDecode")
+
+
+def describe_compression(compression: str, quality: int) -> str:
+    """Describe a compression setting for the X-PDF-Compression response header."""
+    if compression == "flate":
+        return "flate"
+    if compression == "passthrough":
+        return f"passthrough; fallback=jpeg; quality={quality}"
+    return f"jpeg; quality={quality}"
+
+
+class PdfStreamWriter:
+    """Write a PDF document incrementally to a binary stream.
+
+    Every object is serialized as soon as it is added, so callers only ever
+    hold the page they are currently building. The stream is written strictly
+    sequentially (no seeking), which makes it suitable for sockets and pipes;
+    the page tree and cross-reference table are emitted by `close()`.
+    """
+
+    _CATALOG_ID = 1
+    _PAGES_ID = 2
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self._stream = stream
+        self._position = 0
+        self._offsets: dict[int, int] = {}
+        self._next_id = 3
+        self._page_ids: list[int] = []
+        self._closed = False
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self) -> int:
+        return len(self._page_ids)
+
+    def _write(self, data: bytes) -> None:
+        self._stream.write(data)
+        self._position += len(data)
+
+    def _allocate(self) -> int:
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id: int, dictionary: str, stream: bytes | None = None) -> None:
+        self._offsets[obj_id] = self._position
+        if stream is None:
+            self._write(f"{obj_id} 0 obj\n{dictionary}\nendobj\n".encode("latin-1"))
+            return
+        header = f"{obj_id} 0 obj\n<<{dictionary} /Length {len(stream)}>>\nstream\n"
+        self._write(header.encode("latin-1"))
+        self._write(stream)
+        self._write(b"\nendstream\nendobj\n")
+
+    def add_image(self, image: PdfImage) -> int:
+        """Write an image XObject and return its object number."""
+        obj_id = self._allocate()
+        self._write_object(
+            obj_id,
+            f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height}"
+            f" /ColorSpace /{image.color_space} /BitsPerComponent {image.bits_per_component}"
+            f" /Filter /{image.filter}"
+            + (f" /DecodeParms {image.decode_parms}" if image.decode_parms else ""),
+            image.data,
+        )
+        return obj_id
+
+    def add_page(
+        self,
+        width_pt: float,
+        height_pt: float,
+        content: bytes,
+        images: dict[str, int] | None = None,
+    ) -> None:
+        """Write a page whose content stream may reference the given image XObjects."""
+        if self._closed:
+            raise ValueError("Cannot add pages to a closed PDF.")
+        content_id = self._allocate()
+        if len(content) > 256:
+            self._write_object(content_id, "/Filter /FlateDecode", zlib.compress(content, 6))
+        else:
+            self._write_object(content_id, "", content)
+
+        xobjects = " ".join(f"/{name} {obj_id} 0 R" for name, obj_id in (images or {}).items())
+        resources = f"/ProcSet [/PDF /ImageC /ImageB] /XObject <<{xobjects}>>"
+        page_id = self._allocate()
+        self._write_object(
+            page_id,
+            f"<</Type /Page /Parent {self._PAGES_ID} 0 R"
+            f" /MediaBox [0 0 {width_pt:.4f} {height_pt:.4f}]"
+            f" /Resources <<{resources}>> /Contents {content_id} 0 R>>",
+        )
+        self._page_ids.append(page_id)
+
+    def add_image_page(self, image: PdfImage, dpi: int) -> None:
+        """Write a page that is entirely covered by `image` printed at `dpi`."""
+        width_pt = image.width * 72.0 / dpi
+        height_pt = image.height * 72.0 / dpi
+        image_id = self.add_image(image)
+        content = f"q {width_pt:.4f} 0 0 {height_pt:.4f} 0 0 cm /image Do Q".encode("latin-1")
+        self.add_page(width_pt, height_pt, content, {"image": image_id})
+
+    def close(self) -> None:
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        if self._closed:
+            return
+        if not self._page_ids:
+            raise ValueError("A PDF needs at least one page.")
+        self._closed = True
+
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(self._PAGES_ID, f"<</Type /Pages /Kids [{kids}] /Count {len(self._page_ids)}>>")
+        self._write_object(self._CATALOG_ID, f"<</Type /Catalog /Pages {self._PAGES_ID} 0 R>>")
+
+        xref_offset = self._position
+        lines = [f"xref\n0 {self._next_id}\n", "0000000000 65535 f \n"]
+        lines.extend(f"{self._offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, self._next_id))
+        lines.append(f"trailer\n<</Size {self._next_id} /Root {self._CATALOG_ID} 0 R>>\n")
+        lines.append(f"startxref\n{xref_offset}\n%%EOF\n")
+        self._write("".join(lines).encode("latin-1"))
+
+
+class TiffPage(NamedTuple):
+    """A page image compressed into Deflate strips for `TiffStreamWriter`."""
+
+    width: int
+    height: int
+    samples: int
+    rows_per_strip: int
+    strips: tuple[bytes, ...]
+
+
+def encode_tiff_page(image) -> TiffPage:
+    """Compress an RGB or grayscale page into strips of about 256 KiB of pixels each."""
+    if image.mode not in {"RGB", "L"}:
+        image = image.convert("RGB")
+    samples = 3 if image.mode == "RGB" else 1
+    row_bytes = image.width * samples
+    rows_per_strip = max(1, (256 << 10) // row_bytes)
+    with stage("encode"):
+        pixels = memoryview(image.tobytes())
+        strips = tuple(
+            zlib.compress(pixels[top * row_bytes : (top + rows_per_strip) * row_bytes], 6)
+            for top in range(0, image.height, rows_per_strip)
+        )
+    return TiffPage(image.width, image.height, samples, rows_per_strip, strips)
+
+
+class TiffStreamWriter:
+    """Write a multi-page TIFF incrementally to a binary stream.
+
+    Like `PdfStreamWriter`, the stream is written strictly sequentially. Each
+    page is written as its directory (IFD), the values that do not fit in it
+    and then its strips. Because a page is compressed before it is written
+    and the number of pages is known up front, the offset of the next
+    directory is always known when a directory is written.
+    """
+
+    # Field types: SHORT, LONG and RATIONAL (a pair of LONGs).
+    _SHORT, _LONG, _RATIONAL = 3, 4, 5
+
+    def __init__(self, stream: BinaryIO, page_total: int, dpi: int) -> None:
+        self._stream = stream
+        self._page_total = page_total
+        self._dpi = dpi
+        self._position = 0
+        self.page_count = 0
+        self._write(b"II*\x00" + struct.pack("<I", 8))
+
+    def _write(self, data: bytes) -> None:
+        self._stream.write(data)
+        self._position += len(data)
+
+    def add_page(self, page: TiffPage) -> None:
+        if self.page_count == self._page_total:
+            raise ValueError("All pages of the TIFF have already been written.")
+        self.page_count += 1
+        lengths = [len(strip) for strip in page.strips]
+        fields = [
+            (256, self._LONG, [page.width]),
+            (257, self._LONG, [page.height]),
+            (258, self._SHORT, [8] * page.samples),
+            (259, self._SHORT, [8]),  # Deflate
+            (262, self._SHORT, [2 if page.samples == 3 else 1]),  # RGB or BlackIsZero
+            (273, self._LONG, [0] * len(lengths)),  # StripOffsets, filled in below
+            (277, self._SHORT, [page.samples]),
+            (278, self._LONG, [page.rows_per_strip]),
+            (279, self._LONG, lengths),
+            (282, self._RATIONAL, [self._dpi, 1]),
+            (283, self._RATIONAL, [self._dpi, 1]),
+            (284, self._SHORT, [1]),  # Chunky pixels
+            (296, self._SHORT, [2]),  # Resolution in inches
+            (297, self._SHORT, [self.page_count - 1, self._page_total]),
+        ]
+
+        def size(kind: int, values: list) -> int:
+            return len(values) * (2 if kind == self._SHORT else 4)
+
+        # Values over four bytes follow the directory; every size is even, so
+        # they stay word-aligned as TIFF requires.
+        values_offset = self._position + 2 + 12 * len(fields) + 4
+        values_size = sum(size(kind, values) for _, kind, values in fields if size(kind, values) > 4)
+        strips_offset = values_offset + values_size
+        fields[5] = (273, self._LONG, list(accumulate([strips_offset] + lengths[:-1])))
+        strips_end = strips_offset + sum(lengths)
+        if strips_end + 1 >= 2**32:
+            raise ValueError("TIFF output is limited to 4 GB; use a ZIP output format for larger posters.")
+        last = self.page_count == self._page_total
+        next_directory = 0 if last else strips_end + strips_end % 2
+
+        directory = bytearray(struct.pack("<H", len(fields)))
+        values_data = bytearray()
+        for tag, kind, values in fields:
+            data = struct.pack(f"<{len(values)}{'H' if kind == self._SHORT else 'I'}", *values)
+            count = len(values) // 2 if kind == self._RATIONAL else len(values)
+            if len(data) <= 4:
+                directory += struct.pack("<HHI", tag, kind, count) + data.ljust(4, b"\x00")
+            else:
+                directory += struct.pack("<HHII", tag, kind, count, values_offset + len(values_data))
+                values_data += data
+        directory += struct.pack("<I", next_directory)
+        self._write(bytes(directory + values_data))
+        for strip in page.strips:
+            self._write(strip)
+        if not last and strips_end % 2:
+            self._write(b"\x00")
+
+    def close(self) -> None:
+        if self.page_count != self._page_total:
+            raise ValueError(f"The TIFF has {self.page_count} of its {self._page_total} pages.")
+
+
+def encode_page_file(image, image_format: str, quality: int = JPEG_QUALITY, dpi: int = 300) -> bytes:
+    """Encode a page as a standalone PNG or JPEG file that prints at `dpi`."""
+    buffer = BytesIO()
+    with stage("encode"):
+        if image_format == "jpeg":
+            image.save(buffer, format="JPEG", quality=quality, dpi=(dpi, dpi))
+        else:
+            image.save(buffer, format="PNG", compress_level=6, dpi=(dpi, dpi))
+    return buffer.getvalue()
+
+
+@dataclass(frozen=True)
+class PosterLayout:
+    """Pixel geometry of a poster at its output DPI.
+
+    The poster covers `target_w x target_h` pixels made of `columns x rows`
+    tiles. The source image is scaled by `scale_x`/`scale_y` and the covered
+    area starts at `offset_x`/`offset_y` in scaled pixels, so any tile can be
+    mapped back onto the region of the source it was cut from.
+    """
+
+    columns: int
+    rows: int
+    dpi: int
+    page_w_px: int
+    page_h_px: int
+    margin_px: int
+    scale_x: float
+    scale_y: float
+    offset_x: int
+    offset_y: int
+
+    @property
+    def tile_w(self) -> int:
+        return self.page_w_px - 2 * self.margin_px
+
+    @property
+    def tile_h(self) -> int:
+        return self.page_h_px - 2 * self.margin_px
+
+    @property
+    def target_w(self) -> int:
+        return self.tile_w * self.columns
+
+    @property
+    def target_h(self) -> int:
+        return self.tile_h * self.rows
+
+    @property
+    def page_count(self) -> int:
+        return self.columns * self.rows
+
+    @property
+    def source_box(self) -> tuple[float, float, float, float]:
+        """The source-image rectangle covered by the whole poster."""
+        return (
+            self.offset_x / self.scale_x,
+            self.offset_y / self.scale_y,
+            (self.offset_x + self.target_w) / self.scale_x,
+            (self.offset_y + self.target_h) / self.scale_y,
+        )
+
+    def tile_source_box(self, col: int, row: int) -> tuple[float, float, float, float]:
+        """Return the source-image rectangle that the tile at (col, row) is resampled from."""
+        left = self.offset_x + col * self.tile_w
+        top = self.offset_y + row * self.tile_h
+        return (
+            left / self.scale_x,
+            top / self.scale_y,
+            (left + self.tile_w) / self.scale_x,
+            (top + self.tile_h) / self.scale_y,
+        )
+
+
+def plan_poster(
+    image_width_px: int,
+    image_height_px: int,
     columns: int,
     rows: int,
     page_size: str,
     orientation: str,
     margin_mm: float,
     dpi: int,
-) -> BytesIO:
-    try:
-        from PIL import Image  # type: ignore
-    except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency guard
-        raise ImportError(
-            "Pillow is required to rasterbate images. Please install it with `pip install pillow`."
-        ) from exc
+) -> PosterLayout:
+    """Validate the poster settings and compute its layout for a source of the given size.
 
+    A `dpi` below `DPI_MIN` selects the DPI automatically with `suggest_dpi`.
+    """
     if columns < 1 or rows < 1:
         raise ValueError("Columns and rows must be positive integers.")
     if margin_mm < 0:
@@ -851,14 +1751,12 @@ def rasterbate_image(
     if orientation not in {"portrait", "landscape"}:
         raise ValueError("Orientation must be portrait or landscape.")
 
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
-
     width_mm, height_mm = PAGE_SIZES_MM[page_size]
     if orientation == "landscape":
         width_mm, height_mm = height_mm, width_mm
 
     if dpi < DPI_MIN:
-        dpi = suggest_dpi(image.width, image.height, columns, rows, width_mm, height_mm, margin_mm)
+        dpi = suggest_dpi(image_width_px, image_height_px, columns, rows, width_mm, height_mm, margin_mm)
     dpi = max(DPI_MIN, min(DPI_MAX, dpi))
 
     page_w_px = mm_to_px(width_mm, dpi)
@@ -868,126 +1766,3269 @@ def rasterbate_image(
     if margin_px * 2 >= page_w_px or margin_px * 2 >= page_h_px:
         raise ValueError("Margin too large for the selected page size.")
 
-    tile_w = page_w_px - 2 * margin_px
-    tile_h = page_h_px - 2 * margin_px
-
-    target_w = tile_w * columns
-    target_h = tile_h * rows
-
-    image = Image.open(BytesIO(image_bytes)).convert("RGB")
+    target_w = (page_w_px - 2 * margin_px) * columns
+    target_h = (page_h_px - 2 * margin_px) * rows
 
     # Preserve quality while ensuring the poster area is fully filled. We scale
     # up only as much as necessary to cover the grid, then center-crop.
-    scale = max(1.0, target_w / image.width, target_h / image.height)
+    scale = max(1.0, target_w / image_width_px, target_h / image_height_px)
+    scaled_w, scaled_h = image_width_px, image_height_px
     if scale > 1.0:
-        new_size = (int(round(image.width * scale)), int(round(image.height * scale)))
-        image = image.resize(new_size, Image.LANCZOS)
-
-    left = max(0, (image.width - target_w) // 2)
-    top = max(0, (image.height - target_h) // 2)
-    cover = image.crop((left, top, left + target_w, top + target_h))
-
-    mosaic = Image.new("RGB", (target_w, target_h), "white")
-    mosaic.paste(cover, (0, 0))
-
-    pages = []
-    for row in range(rows):
-        for col in range(columns):
-            crop_box = (
-                col * tile_w,
-                row * tile_h,
-                (col + 1) * tile_w,
-                (row + 1) * tile_h,
-            )
-            tile = mosaic.crop(crop_box)
-            page = Image.new("RGB", (page_w_px, page_h_px), "white")
-            page.paste(tile, (margin_px, margin_px))
-            pages.append(page)
+        scaled_w, scaled_h = int(round(image_width_px * scale)), int(round(image_height_px * scale))
 
-    output = BytesIO()
-    pages[0].save(output, format="PDF", save_all=True, append_images=pages[1:], resolution=dpi)
-    output.seek(0)
-    return output
+    return PosterLayout(
+        columns=columns,
+        rows=rows,
+        dpi=dpi,
+        page_w_px=page_w_px,
+        page_h_px=page_h_px,
+        margin_px=margin_px,
+        scale_x=scaled_w / image_width_px,
+        scale_y=scaled_h / image_height_px,
+        offset_x=max(0, (scaled_w - target_w) // 2),
+        offset_y=max(0, (scaled_h - target_h) // 2),
+    )
 
 
-class RasterbatorHandler(BaseHTTPRequestHandler):
-    def do_GET(self) -> None:  # noqa: N802 - name required by BaseHTTPRequestHandler
-        page = build_page().encode("utf-8")
-        self.send_response(200)
-        self.send_header("Content-Type", "text/html; charset=utf-8")
-        self.send_header("Content-Length", str(len(page)))
-        self.end_headers()
-        self.wfile.write(page)
+def parse_render_settings(fields: dict) -> dict:
+    """Read poster settings from submitted form fields, applying the form's defaults.
 
-    def do_POST(self) -> None:  # noqa: N802 - name required by BaseHTTPRequestHandler
-        if self.path != "/rasterbate":
-            self.send_error(404, "Not Found")
-            return
+    The result can be passed to `rasterbate_image` as keyword arguments. A
+    missing or malformed DPI selects the DPI automatically.
+    """
+    try:
+        dpi = int(fields["dpi"]) if fields.get("dpi") is not None else -1
+    except ValueError:
+        dpi = -1
+    return {
+        "columns": int(fields.get("columns", "3")),
+        "rows": int(fields.get("rows", "3")),
+        "page_size": fields.get("page_size", "A4"),
+        "orientation": fields.get("orientation", "portrait").lower(),
+        "margin_mm": float(fields.get("margin", "10")),
+        "dpi": dpi,
+        "style": fields.get("style", "photo").lower(),
+        "cell_mm": float(fields.get("cell_mm", str(HALFTONE_CELL_MM))),
+        "shared_image": fields.get("shared_image", "").lower() in {"1", "on", "true", "yes"},
+        "compression": fields.get("compression", "jpeg").lower(),
+        "quality": int(fields.get("quality", str(JPEG_QUALITY))),
+        "output_format": fields.get("output_format", "pdf").lower(),
+    }
 
-        content_type = self.headers.get("Content-Type", "")
-        if not content_type.startswith("multipart/form-data"):
-            self.send_error(400, "Expected multipart/form-data")
-            return
 
-        content_length = int(self.headers.get("Content-Length", "0"))
-        if content_length <= 0:
-            self.send_error(400, "Missing request body")
-            return
+def plan_poster_for_settings(image_width_px: int, image_height_px: int, settings: dict) -> PosterLayout:
+    """Plan a poster from `parse_render_settings` output, validating the style as well."""
+    if settings["style"] != "photo" and settings["style"] not in HALFTONE_STYLES:
+        raise ValueError("Unsupported style.")
+    if settings["compression"] not in PDF_COMPRESSIONS:
+        raise ValueError("Unsupported compression.")
+    if not 1 <= settings["quality"] <= 95:
+        raise ValueError("JPEG quality must be between 1 and 95.")
+    if settings["output_format"] not in OUTPUT_FORMATS:
+        raise ValueError("Unsupported output format.")
+    layout = plan_poster(
+        image_width_px,
+        image_height_px,
+        settings["columns"],
+        settings["rows"],
+        settings["page_size"],
+        settings["orientation"],
+        settings["margin_mm"],
+        settings["dpi"],
+    )
+    if settings["style"] != "photo":
+        halftone_grid_size(layout, settings["cell_mm"])
+    return layout
 
-        body = self.rfile.read(content_length)
-        try:
-            fields, files = parse_multipart_form(body, content_type)
-        except Exception as exc:  # pylint: disable=broad-except
-            self.send_error(400, f"Failed to parse form data: {exc}")
-            return
 
-        if "image" not in files:
-            self.send_error(400, "Image upload is required")
-            return
+class RenderTooLargeError(ValueError):
+    """Raised when a poster would cost more than a single render may use."""
 
-        def parse_int(value: str | None, fallback: int) -> int:
-            try:
-                return int(value) if value is not None else fallback
-            except ValueError:
-                return fallback
 
-        try:
-            columns = int(fields.get("columns", "3"))
-            rows = int(fields.get("rows", "3"))
-            margin_mm = float(fields.get("margin", "10"))
-            dpi = parse_int(fields.get("dpi"), -1)
-            page_size = fields.get("page_size", "A4")
-            orientation = fields.get("orientation", "portrait")
-
-            image_bytes = files["image"]["content"]
-            pdf = rasterbate_image(
-                image_bytes=image_bytes,
-                columns=columns,
-                rows=rows,
-                page_size=page_size,
-                orientation=orientation,
-                margin_mm=margin_mm,
-                dpi=dpi,
+# Single-core CPU seconds per megapixel of pages for each page encoding, and
+# per halftone mark, measured on a typical server; these only need to be
+# right to within a small factor.
+ENCODE_SECONDS_PER_MEGAPIXEL = {"jpeg": 0.04, "flate": 0.2, "tiff": 0.12, "zip-png": 0.2, "zip-jpeg": 0.03}
+HALFTONE_MARK_SECONDS = 5e-6
+DECODE_SECONDS_PER_MEGAPIXEL = 0.02
+# Memory held per mark while a halftone page's PDF content stream is built.
+HALFTONE_MARK_BYTES = 256
+
+
+class RenderCost(NamedTuple):
+    """Predicted size of a render, computed from the header dimensions alone."""
+
+    output_pixels: int
+    memory_bytes: int
+    cpu_seconds: float = 0.0
+
+
+def estimate_render_cost(
+    image_size: tuple[int, int],
+    layout: PosterLayout,
+    settings: dict,
+    workers: int | None = None,
+) -> RenderCost:
+    """Estimate the output pixels and peak memory of rendering a poster.
+
+    Pillow keeps RGB pixels in four bytes. A photo render holds the decoded
+    source plus one page and its tile per process; render processes map a
+    copy of the source from a temporary file rather than holding their own. Shared-image posters hold a crop of
+    the source instead of pages, and halftone posters only a small grid. The
+    source is counted at full size even where a JPEG draft decode would be
+    smaller, so the estimate errs on the high side. Sources that
+    `load_rgb_image` maps to disk do not count at all. Halftone pages are
+    only rasterized, one at a time, for output formats other than PDF; PDF
+    pages hold the content stream of every mark on the page instead.
+
+    CPU time is the total across processes: decoding the source, encoding
+    every page (or the covered source for a shared-image PDF), and drawing
+    every halftone mark.
+    """
+    output_pixels = layout.page_w_px * layout.page_h_px * layout.page_count
+    source_bytes, decode_seconds = estimate_decode_cost(image_size)[1:]
+    output_format = settings.get("output_format", "pdf")
+    pdf = output_format == "pdf"
+    compression = "flate" if settings.get("compression") == "flate" else "jpeg"
+    encode_seconds = ENCODE_SECONDS_PER_MEGAPIXEL[compression if pdf else output_format] / 1e6
+    if settings.get("style", "photo") != "photo":
+        grid_w, grid_h = halftone_grid_size(layout, settings.get("cell_mm", HALFTONE_CELL_MM))
+        cpu_seconds = decode_seconds + grid_w * grid_h * HALFTONE_MARK_SECONDS
+        if pdf:
+            # The busiest page holds a whole tile of cells plus those straddling its edges.
+            page_marks = (math.ceil(layout.tile_w * grid_w / layout.target_w) + 1) * (
+                math.ceil(layout.tile_h * grid_h / layout.target_h) + 1
             )
-        except Exception as exc:  # pylint: disable=broad-except
-            self.send_error(400, f"Failed to rasterbate image: {exc}")
-            return
+            page_bytes = min(grid_w * grid_h, page_marks) * HALFTONE_MARK_BYTES
+        else:
+            page_bytes = layout.page_w_px * layout.page_h_px * 4
+            cpu_seconds += output_pixels * encode_seconds
+        return RenderCost(output_pixels, source_bytes + grid_w * grid_h * 4 + page_bytes, cpu_seconds)
+    if settings.get("shared_image") and pdf:
+        left, top, right, bottom = shared_image_crop_box(layout, image_size)
+        crop_pixels = (right - left) * (bottom - top)
+        return RenderCost(output_pixels, source_bytes + crop_pixels * 4, decode_seconds + crop_pixels * encode_seconds)
 
-        pdf_bytes = pdf.getvalue()
-        self.send_response(200)
-        self.send_header("Content-Type", "application/pdf")
-        self.send_header("Content-Length", str(len(pdf_bytes)))
-        self.send_header("Content-Disposition", "attachment; filename=poster.pdf")
-        self.end_headers()
-        self.wfile.write(pdf_bytes)
+    page_bytes = (layout.page_w_px * layout.page_h_px + layout.tile_w * layout.tile_h) * 4
+    processes = workers if workers and workers > 1 and layout.page_count > 1 else 0
+    return RenderCost(
+        output_pixels,
+        source_bytes + page_bytes * (1 + processes),
+        decode_seconds + output_pixels * encode_seconds,
+    )
 
-    def log_message(self, format: str, *args) -> None:  # noqa: A003 - inherits name from base class
-        return  # Silence default console logging for cleaner output
 
+def estimate_decode_cost(image_size: tuple[int, int]) -> RenderCost:
+    """Estimate the memory and CPU time of decoding a source with `load_rgb_image`."""
+    pixels = image_size[0] * image_size[1]
+    return RenderCost(0, 0 if maps_source(image_size) else pixels * 4, pixels * DECODE_SECONDS_PER_MEGAPIXEL / 1e6)
+
+
+def estimate_preview_cost(
+    layout: PosterLayout,
+    settings: dict,
+    max_size: int,
+    decode_size: tuple[int, int] | None = None,
+) -> RenderCost:
+    """Estimate the cost of `render_preview`, including decoding a source of `decode_size` first.
+
+    The preview image itself is small, but halftone styles also average the
+    source into the full cell grid and draw every mark, scaled down.
+    """
+    if decode_size is not None:
+        preview = estimate_preview_cost(layout, settings, max_size)
+        decode = estimate_decode_cost(decode_size)
+        return RenderCost(
+            preview.output_pixels,
+            preview.memory_bytes + decode.memory_bytes,
+            preview.cpu_seconds + decode.cpu_seconds,
+        )
+    poster_w = layout.page_w_px * layout.columns
+    poster_h = layout.page_h_px * layout.rows
+    scale = min(1.0, max_size / poster_w, max_size / poster_h)
+    preview_pixels = max(1, round(poster_w * scale)) * max(1, round(poster_h * scale))
+    cpu_seconds = preview_pixels * ENCODE_SECONDS_PER_MEGAPIXEL["jpeg"] / 1e6
+    if settings.get("style", "photo") == "photo":
+        return RenderCost(preview_pixels, preview_pixels * 4, cpu_seconds)
+    grid_w, grid_h = halftone_grid_size(layout, settings.get("cell_mm", HALFTONE_CELL_MM))
+    cells = grid_w * grid_h
+    return RenderCost(preview_pixels, (preview_pixels + cells) * 4, cpu_seconds + cells * HALFTONE_MARK_SECONDS)
+
+
+def check_render_cost(
+    cost: RenderCost,
+    max_output_pixels: int | None,
+    max_memory_bytes: int | None,
+    max_cpu_seconds: float | None = None,
+) -> None:
+    """Raise `RenderTooLargeError` when a render exceeds the per-request limits."""
+    if max_output_pixels is not None and cost.output_pixels > max_output_pixels:
+        raise RenderTooLargeError(
+            f"Poster is too large: {cost.output_pixels / 1e6:.0f} megapixels of pages exceeds the"
+            f" {max_output_pixels / 1e6:.0f} megapixel limit. Use fewer pages or a lower DPI"
+        )
+    if max_memory_bytes is not None and cost.memory_bytes > max_memory_bytes:
+        raise RenderTooLargeError(
+            f"Poster is too large: rendering it would need about {cost.memory_bytes // 2**20} MB of memory,"
+            f" more than the {max_memory_bytes // 2**20} MB available. Use a smaller image, fewer pages"
+            " or a lower DPI"
+        )
+    if max_cpu_seconds is not None and cost.cpu_seconds > max_cpu_seconds:
+        raise RenderTooLargeError(
+            f"Poster is too large: rendering it would take about {cost.cpu_seconds:.0f} seconds of CPU time,"
+            f" more than the {max_cpu_seconds:.0f} second limit. Use fewer pages, a lower DPI, JPEG"
+            " compression or a larger dot size"
+        )
+
+
+def render_page(image, layout: PosterLayout, col: int, row: int):
+    """Render one printable page straight from the source image.
+
+    Only the tile's own region of the source is resampled, so memory use is
+    proportional to a single page rather than the whole poster.
+    """
+    from PIL import Image  # type: ignore
+
+    box = layout.tile_source_box(col, row)
+    size = (layout.tile_w, layout.tile_h)
+    if layout.scale_x == 1.0 and layout.scale_y == 1.0:
+        with stage("tile"):
+            tile = image.crop(tuple(int(edge) for edge in box))
+    else:
+        with stage("resize"):
+            tile = image.resize(size, Image.LANCZOS, box=box)
 
-def main() -> None:
-    server = HTTPServer((HOST, PORT), RasterbatorHandler)
-    print(f"Rasterbator-style site running at http://{HOST}:{PORT}")
+    with stage("tile"):
+        page = Image.new("RGB", (layout.page_w_px, layout.page_h_px), "white")
+        page.paste(tile, (layout.margin_px, layout.margin_px))
+    return page
+
+
+def halftone_grid_size(layout: PosterLayout, cell_mm: float) -> tuple[int, int]:
+    """Return how many halftone cells fit across and down the poster.
+
+    Raises ValueError for a dot size outside the form's range or a poster of
+    more than `MAX_HALFTONE_CELLS` cells.
+    """
+    if not HALFTONE_CELL_MIN_MM <= cell_mm <= HALFTONE_CELL_MAX_MM:
+        raise ValueError(f"Dot size must be between {HALFTONE_CELL_MIN_MM:g} and {HALFTONE_CELL_MAX_MM:g} mm.")
+    cell_px = max(2, mm_to_px(cell_mm, layout.dpi))
+    grid_w, grid_h = max(1, round(layout.target_w / cell_px)), max(1, round(layout.target_h / cell_px))
+    if grid_w * grid_h > MAX_HALFTONE_CELLS:
+        raise ValueError(
+            f"Too many halftone dots: {grid_w * grid_h:,} exceeds the limit of {MAX_HALFTONE_CELLS:,}."
+            " Use a larger dot size or fewer pages."
+        )
+    return grid_w, grid_h
+
+
+def halftone_source_size(
+    layout: PosterLayout, grid_size: tuple[int, int], source_size: tuple[int, int]
+) -> tuple[int, int]:
+    """Return the smallest source size that still has a pixel for every halftone cell."""
+    left, top, right, bottom = layout.source_box
+    return (
+        math.ceil(source_size[0] * grid_size[0] / (right - left)),
+        math.ceil(source_size[1] * grid_size[1] / (bottom - top)),
+    )
+
+
+def halftone_grid(image, layout: PosterLayout, grid_size: tuple[int, int], source_size: tuple[int, int]):
+    """Average the poster area of `image` down to one luminance value per halftone cell.
+
+    `source_size` is the size of the image the layout was planned for; `image`
+    may be a reduced-size decode of it. Pillow's BOX filter averages every
+    source pixel in a cell in C, so no per-pixel Python work is involved.
+    """
+    from PIL import Image  # type: ignore
+
+    factor_x = image.width / source_size[0]
+    factor_y = image.height / source_size[1]
+    left, top, right, bottom = layout.source_box
+    box = (left * factor_x, top * factor_y, right * factor_x, bottom * factor_y)
+    with stage("resize"):
+        return image.resize(grid_size, Image.BOX, box=box).convert("L")
+
+
+def halftone_marks(grid, layout: PosterLayout, col: int, row: int, style: str):
+    """Yield the halftone marks that touch the tile at (col, row).
+
+    Each mark is a tuple of (kind, left, top, right, bottom) in tile pixels,
+    where kind is "ellipse" or "rect". Marks are sized so that the inked area
+    of a cell is proportional to its darkness; cells crossing a page edge
+    yield a mark on both pages and are clipped by the page.
+    """
+    cell_w = layout.target_w / grid.width
+    cell_h = layout.target_h / grid.height
+    tile_x = col * layout.tile_w
+    tile_y = row * layout.tile_h
+    first_i = int(tile_x // cell_w)
+    last_i = min(grid.width, math.ceil((tile_x + layout.tile_w) / cell_w))
+    first_j = int(tile_y // cell_h)
+    last_j = min(grid.height, math.ceil((tile_y + layout.tile_h) / cell_h))
+    values = grid.tobytes()
+    max_radius = min(cell_w, cell_h) / math.sqrt(2)
+
+    for j in range(first_j, last_j):
+        center_y = (j + 0.5) * cell_h - tile_y
+        for i in range(first_i, last_i):
+            darkness = 1.0 - values[j * grid.width + i] / 255.0
+            if darkness <= 0.0:
+                continue
+            center_x = (i + 0.5) * cell_w - tile_x
+            if style == "dots":
+                radius = min(max_radius, math.sqrt(darkness * cell_w * cell_h / math.pi))
+                yield ("ellipse", center_x - radius, center_y - radius, center_x + radius, center_y + radius)
+            elif style == "squares":
+                half = math.sqrt(darkness * cell_w * cell_h) / 2
+                yield ("rect", center_x - half, center_y - half, center_x + half, center_y + half)
+            else:
+                half = darkness * cell_h / 2
+                yield ("rect", center_x - cell_w / 2, center_y - half, center_x + cell_w / 2, center_y + half)
+
+
+def render_halftone_page(grid, layout: PosterLayout, col: int, row: int, style: str):
+    """Render one printable halftone page from a cell-intensity grid."""
+    from PIL import Image, ImageDraw  # type: ignore
+
+    tile = Image.new("L", (layout.tile_w, layout.tile_h), 255)
+    draw = ImageDraw.Draw(tile)
+    for kind, left, top, right, bottom in halftone_marks(grid, layout, col, row, style):
+        # Pillow fills both end pixels of a shape, one more than the mark's
+        # width, which would print darker than the vector PDF of the same marks.
+        box = (left, top, max(left, right - 1), max(top, bottom - 1))
+        if kind == "ellipse":
+            draw.ellipse(box, fill=0)
+        else:
+            draw.rectangle(box, fill=0)
+
+    page = Image.new("L", (layout.page_w_px, layout.page_h_px), 255)
+    page.paste(tile, (layout.margin_px, layout.margin_px))
+    return page
+
+
+def halftone_page_content(grid, layout: PosterLayout, col: int, row: int, style: str) -> bytes:
+    """Return a PDF content stream that draws one halftone page as vector paths.
+
+    Marks come from `halftone_marks` in tile pixels. A single transform maps
+    those pixels onto the page in points (flipping the y axis), and a clip
+    rectangle trims marks that straddle the tile edge, so pages only differ in
+    the tile offset applied by `halftone_marks`.
+    """
+    scale = 72.0 / layout.dpi
+    page_h_pt = layout.page_h_px * scale
+    margin_pt = layout.margin_px * scale
+    parts = [
+        f"q {scale:.6f} 0 0 {-scale:.6f} {margin_pt:.4f} {page_h_pt - margin_pt:.4f} cm",
+        f"0 0 {layout.tile_w} {layout.tile_h} re W n 0 g",
+    ]
+    rects = []
+    dots = []
+    for kind, left, top, right, bottom in halftone_marks(grid, layout, col, row, style):
+        if kind == "rect":
+            rects.append(f"{left:.2f} {top:.2f} {right - left:.2f} {bottom - top:.2f} re")
+        else:
+            center = f"{(left + right) / 2:.2f} {(top + bottom) / 2:.2f}"
+            dots.append(f"{right - left:.2f} w {center} m {center} l S")
+    if rects:
+        parts.extend(rects)
+        parts.append("f")
+    if dots:
+        # A zero-length segment stroked with round caps paints a filled circle
+        # whose diameter is the line width, which is far more compact than four
+        # Bezier curves per dot.
+        parts.append("1 J 0 G")
+        parts.extend(dots)
+    parts.append("Q")
+    return "\n".join(parts).encode("latin-1")
+
+
+def _render_page_image(image, layout: PosterLayout, col: int, row: int, style: str):
+    # For halftone styles `image` is the cell-intensity grid.
+    if style == "photo":
+        return render_page(image, layout, col, row)
+    with stage("tile"):
+        return render_halftone_page(image, layout, col, row, style)
+
+
+def shared_image_crop_box(layout: PosterLayout, image_size: tuple[int, int]) -> tuple[int, int, int, int]:
+    """Return the whole-pixel source rectangle to embed for a shared-image PDF."""
+    left, top, right, bottom = layout.source_box
+    return (
+        max(0, math.floor(left)),
+        max(0, math.floor(top)),
+        min(image_size[0], math.ceil(right)),
+        min(image_size[1], math.ceil(bottom)),
+    )
+
+
+def shared_image_page_content(
+    layout: PosterLayout,
+    crop_box: tuple[int, int, int, int],
+    col: int,
+    row: int,
+) -> bytes:
+    """Return a content stream that shows the tile at (col, row) of a shared image.
+
+    The embedded image holds `crop_box` of the source at native resolution.
+    The page clips to its tile rectangle and places the image with a single
+    transform so that the tile's part of the poster lands inside the margins.
+    """
+    scale = 72.0 / layout.dpi
+    page_h_pt = layout.page_h_px * scale
+    image_w = (crop_box[2] - crop_box[0]) * layout.scale_x
+    image_h = (crop_box[3] - crop_box[1]) * layout.scale_y
+    # Top-left corner of the image in page pixels, measured from the page's top-left.
+    image_x = layout.margin_px + crop_box[0] * layout.scale_x - layout.offset_x - col * layout.tile_w
+    image_y = layout.margin_px + crop_box[1] * layout.scale_y - layout.offset_y - row * layout.tile_h
+    clip_x = layout.margin_px * scale
+    clip_y = page_h_pt - (layout.margin_px + layout.tile_h) * scale
+    return (
+        f"q {clip_x:.4f} {clip_y:.4f} {layout.tile_w * scale:.4f} {layout.tile_h * scale:.4f} re W n"
+        f" {image_w * scale:.4f} 0 0 {image_h * scale:.4f}"
+        f" {image_x * scale:.4f} {page_h_pt - (image_y + image_h) * scale:.4f} cm /poster Do Q"
+    ).encode("latin-1")
+
+
+PREVIEW_SIZE = 800
+PREVIEW_SIZE_MAX = 2048
+
+
+def render_preview(
+    source,
+    layout: PosterLayout,
+    max_size: int = PREVIEW_SIZE,
+    style: str = "photo",
+    cell_mm: float = HALFTONE_CELL_MM,
+):
+    """Render a small image of the printed poster, pages side by side.
+
+    The preview is at most `max_size` pixels on its longer side and uses the
+    same geometry as the PDF: each tile comes from `tile_source_box` and sits
+    inside its page's margins on white paper. Photo tiles are resampled from
+    the smallest `ImagePyramid` level that still has a pixel per preview
+    pixel, and halftone styles draw the same marks as the PDF, scaled down.
+    """
+    from PIL import Image, ImageDraw  # type: ignore
+
+    pyramid = source if isinstance(source, ImagePyramid) else ImagePyramid(load_rgb_image(source))
+    width, height = pyramid.size
+    poster_w = layout.page_w_px * layout.columns
+    poster_h = layout.page_h_px * layout.rows
+    scale = min(1.0, max_size / poster_w, max_size / poster_h)
+    preview = Image.new("RGB", (max(1, round(poster_w * scale)), max(1, round(poster_h * scale))), "white")
+
+    if style == "photo":
+        needed = (math.ceil(width * layout.scale_x * scale), math.ceil(height * layout.scale_y * scale))
+        level = pyramid.level_for((min(width, needed[0]), min(height, needed[1])))
+        factor_x, factor_y = level.width / width, level.height / height
+    else:
+        grid_size = halftone_grid_size(layout, cell_mm)
+        level = pyramid.level_for(halftone_source_size(layout, grid_size, (width, height)))
+        grid = halftone_grid(level, layout, grid_size, (width, height))
+
+    for row in range(layout.rows):
+        for col in range(layout.columns):
+            left = round((col * layout.page_w_px + layout.margin_px) * scale)
+            top = round((row * layout.page_h_px + layout.margin_px) * scale)
+            right = round((col * layout.page_w_px + layout.margin_px + layout.tile_w) * scale)
+            bottom = round((row * layout.page_h_px + layout.margin_px + layout.tile_h) * scale)
+            if right <= left or bottom <= top:
+                continue
+            if style == "photo":
+                box_left, box_top, box_right, box_bottom = layout.tile_source_box(col, row)
+                box = (box_left * factor_x, box_top * factor_y, box_right * factor_x, box_bottom * factor_y)
+                tile = level.resize((right - left, bottom - top), Image.LANCZOS, box=box)
+            else:
+                tile = Image.new("L", (right - left, bottom - top), 255)
+                draw = ImageDraw.Draw(tile)
+                tile_scale_x = (right - left) / layout.tile_w
+                tile_scale_y = (bottom - top) / layout.tile_h
+                for kind, mark_left, mark_top, mark_right, mark_bottom in halftone_marks(grid, layout, col, row, style):
+                    shape = (
+                        mark_left * tile_scale_x,
+                        mark_top * tile_scale_y,
+                        mark_right * tile_scale_x,
+                        mark_bottom * tile_scale_y,
+                    )
+                    if kind == "ellipse":
+                        draw.ellipse(shape, fill=0)
+                    else:
+                        draw.rectangle(shape, fill=0)
+            preview.paste(tile, (left, top))
+    return preview
+
+
+def encode_preview(image, image_format: str = "jpeg") -> bytes:
+    """Encode a preview as JPEG or PNG bytes."""
+    buffer = BytesIO()
+    if image_format == "png":
+        image.save(buffer, format="PNG", optimize=False, compress_level=6)
+    else:
+        image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class RenderPool:
+    """A long-lived pool of `workers` processes that render pages for any number of posters.
+
+    The processes are started by a fork server, never forked from the caller,
+    whose other threads may be holding locks at the time, and are reused from
+    one render to the next. A server owns one pool for its whole life.
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_render_worker)
+
+    def submit(self, *args):
+        """Schedule `_render_encoded_page(*args)` and return its future."""
+        return self._executor.submit(_render_encoded_page, *args)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _init_render_worker() -> None:
+    # Ctrl-C reaches the whole process group; the process that owns the pool
+    # decides what happens to the renders in flight.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _share_render_image(image) -> str:
+    # Writes `image` to a temporary file in Pillow's own pixel layout ("L" in
+    # one byte a pixel, RGB in four), a strip at a time, so that render
+    # processes can map it instead of each receiving a pickled copy.
+    raw_mode = "L" if image.mode == "L" else "RGBX"
+    strip = max(1, (16 << 20) // (image.width * 4))
+    with NamedTemporaryFile(prefix="rasterbator-", delete=False) as file:
+        for top in range(0, image.height, strip):
+            file.write(image.crop((0, top, image.width, min(image.height, top + strip))).tobytes("raw", raw_mode))
+    return file.name
+
+
+# Images shared with this render process, by path, most recently used last.
+_render_worker_images: OrderedDict = OrderedDict()
+
+
+def _render_worker_image(path: str, mode: str, size: tuple[int, int]):
+    # Renders take turns on the pool, so each process keeps the last two
+    # images it was handed, and drops those whose render has finished and
+    # removed the file.
+    from PIL import Image  # type: ignore
+
+    for stale in [known for known in _render_worker_images if not os.path.exists(known)]:
+        del _render_worker_images[stale]
+    image = _render_worker_images.get(path)
+    if image is None:
+        with open(path, "rb") as file:
+            image = _mapped_image(mode, size, file)
+            if image is None:
+                image = Image.frombytes(mode, size, file.read(), "raw", "L" if mode == "L" else "RGBX")
+        _render_worker_images[path] = image
+        while len(_render_worker_images) > 2:
+            _render_worker_images.popitem(last=False)
+    _render_worker_images.move_to_end(path)
+    return image
+
+
+def _render_encoded_page(
+    path: str, mode: str, size: tuple[int, int], layout: PosterLayout, style: str, encode: Callable, index: int
+) -> tuple:
+    # Stage timings travel back with the page so the parent can report them.
+    row, col = divmod(index, layout.columns)
+    with record_stages() as timings:
+        page = _render_page_image(_render_worker_image(path, mode, size), layout, col, row, style)
+        encoded = encode(page)
+    return encoded, timings
+
+
+def iter_encoded_pages(
+    image,
+    layout: PosterLayout,
+    workers: int | RenderPool | None = None,
+    style: str = "photo",
+    compression: str = "jpeg",
+    quality: int = JPEG_QUALITY,
+    encode: Callable | None = None,
+):
+    """Yield the encoded pages of a poster in row-major order.
+
+    For halftone styles `image` is the cell-intensity grid from `halftone_grid`.
+    Pages are encoded with `encode_pdf_image` unless `encode` is given, which
+    must be picklable for `workers`, such as a `partial` of a module function.
+
+    With `workers`, tile resampling and encoding are spread over a process
+    pool: a `RenderPool`, or a number of processes greater than one for a
+    pool started just for these pages. The image is written once to a
+    temporary file that every process maps (see `_share_render_image`), and
+    at most two pages per process are in flight at any time. The encoded
+    output is identical to the serial path.
+    """
+    if encode is None:
+        encode = partial(encode_pdf_image, compression=compression, quality=quality)
+    if not workers or (isinstance(workers, int) and workers <= 1) or layout.page_count == 1:
+        for index in range(layout.page_count):
+            row, col = divmod(index, layout.columns)
+            yield encode(_render_page_image(image, layout, col, row, style))
+        return
+
+    pool = workers if isinstance(workers, RenderPool) else RenderPool(workers)
+    with stage("tile"):
+        path = _share_render_image(image)
+    submit = partial(pool.submit, path, image.mode, image.size, layout, style, encode)
+    indices = iter(range(layout.page_count))
+    pending = deque(submit(index) for index in islice(indices, pool.workers * 2))
+    try:
+        while pending:
+            encoded, timings = pending.popleft().result()
+            for name, seconds in timings.items():
+                add_stage_time(name, seconds)
+            next_index = next(indices, None)
+            if next_index is not None:
+                pending.append(submit(next_index))
+            yield encoded
+    finally:
+        for future in pending:
+            future.cancel()
+        os.unlink(path)
+        if pool is not workers:
+            pool.shutdown()
+
+
+def set_max_source_megapixels(megapixels: int) -> None:
+    """Accept source images of up to `megapixels`, in this process and any it forks.
+
+    Pillow's own decompression-bomb limit is set to match, so it never
+    refuses an image `open_image` would accept. Its warning for images just
+    over the limit is silenced, since `open_image` refuses those itself.
+    """
+    global MAX_SOURCE_MEGAPIXELS  # pylint: disable=global-statement
+    from PIL import Image  # type: ignore
+
+    MAX_SOURCE_MEGAPIXELS = megapixels
+    Image.MAX_IMAGE_PIXELS = megapixels * 1_000_000
+    warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+
+
+def open_image(source):
+    """Open an encoded image with Pillow, refusing sources over `MAX_SOURCE_MEGAPIXELS`.
+
+    Only the header is read, so oversized images are refused before anything
+    is decoded, as are those that trip Pillow's decompression-bomb check.
+    """
+    from PIL import Image  # type: ignore
+
+    try:
+        image = Image.open(source)
+    except Image.DecompressionBombError as exc:
+        raise RenderTooLargeError(
+            f"Image is too large: it exceeds the {MAX_SOURCE_MEGAPIXELS} megapixel limit"
+        ) from exc
+    if image.width * image.height > MAX_SOURCE_MEGAPIXELS * 1_000_000:
+        raise RenderTooLargeError(
+            f"Image is too large: {image.width * image.height / 1e6:.0f} megapixels exceeds the"
+            f" {MAX_SOURCE_MEGAPIXELS} megapixel limit"
+        )
+    return image
+
+
+def probe_image_size(source) -> tuple[int, int]:
+    """Read the pixel size of an encoded image from its header without decoding it.
+
+    File objects are rewound afterwards so they can be decoded later. Decoded
+    Pillow images simply report their size.
+    """
+    from PIL import Image  # type: ignore
+
+    if isinstance(source, (Image.Image, ImagePyramid)):
+        return source.size
+    if isinstance(source, (bytes, bytearray)):
+        return open_image(BytesIO(source)).size
+    position = source.tell()
+    try:
+        return open_image(source).size
+    finally:
+        source.seek(position)
+
+
+def maps_source(size: tuple[int, int]) -> bool:
+    """Return True when `load_rgb_image` decodes an image of `size` into a memory-mapped file."""
+    return size[0] * size[1] >= MAP_SOURCE_MEGAPIXELS * 1_000_000
+
+
+def _mapped_image(mode: str, size: tuple[int, int], file=None):
+    # A blank image whose pixels live in an unlinked temporary file, or a
+    # read-only one over the pixels already in `file`; None when this Pillow
+    # lacks the internals used to build one. Mapped "L" and "P" pixels take
+    # one byte, "I;16" variants two and every other mode four.
+    from PIL import Image  # type: ignore
+
+    if not hasattr(Image.core, "map_buffer") or not hasattr(Image.Image, "_new"):
+        return None
+    stride = size[0] * (1 if mode in ("L", "P") else 2 if mode.startswith("I;16") else 4)
+    if file is not None:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        with TemporaryFile(prefix="rasterbator-") as temporary:
+            temporary.truncate(stride * size[1])
+            buffer = mmap.mmap(temporary.fileno(), 0)
+    # `map_buffer` wraps the mapping without copying it, and the image keeps
+    # the mapping alive for as long as it exists.
+    return Image.new(mode, (0, 0))._new(Image.core.map_buffer(buffer, size, "raw", 0, (mode, stride, 1)))
+
+
+def _decode_mapped(image):
+    """Decode an opened image into RGB pixels held in a memory-mapped temporary file.
+
+    The decoder writes straight into the mapping, so the pixels never have to
+    fit in memory: the kernel writes pages back to disk under pressure and
+    reads in only the rows a crop or resize touches. Other modes are decoded
+    into a mapping of their own and converted to RGB a strip at a time.
+
+    This relies on Pillow internals (see `_mapped_image`); where they are
+    missing, the image is decoded into memory as usual.
+    """
+    rgb = _mapped_image("RGB", image.size)
+    if rgb is None:
+        return image.convert("RGB")
+    try:
+        target = rgb if image.mode == "RGB" else _mapped_image(image.mode, image.size)
+        image.im = target.im
+    except (AttributeError, ValueError):
+        return image.convert("RGB")
+    # The decoder fills the mapping; Pillow maps uncompressed files itself,
+    # in which case it replaces the target with its own mapping of the file.
+    image.load()
+    if image.mode == "RGB":
+        return image
+
+    strip = max(1, (16 << 20) // (image.width * 4))
+    for top in range(0, image.height, strip):
+        box = (0, top, image.width, min(image.height, top + strip))
+        rgb.paste(image.crop(box).convert("RGB"), box[:2])
+    return rgb
+
+
+def load_rgb_image(source, draft_size: tuple[int, int] | None = None):
+    """Decode raw image bytes or a binary file object into an RGB Pillow image.
+
+    Images that are already decoded are converted to RGB if necessary and
+    otherwise returned unchanged; an `ImagePyramid` yields its full-size
+    level. When `draft_size` is given, JPEGs are decoded at the smallest DCT
+    scale (1/2, 1/4 or 1/8) that still yields at least that many pixels,
+    which is far cheaper than decoding at full resolution and downscaling
+    afterwards. Callers must then work with the decoded size. Decodes of at
+    least `MAP_SOURCE_MEGAPIXELS` are backed by a memory-mapped temporary
+    file rather than memory, so their size is limited by disk space.
+    """
+    try:
+        from PIL import Image  # type: ignore
+    except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency guard
+        raise ImportError(
+            "Pillow is required to rasterbate images. Please install it with `pip install pillow`."
+        ) from exc
+
+    if isinstance(source, ImagePyramid):
+        return source.base
+    with stage("decode"):
+        if isinstance(source, Image.Image):
+            return source if source.mode == "RGB" else source.convert("RGB")
+        if isinstance(source, (bytes, bytearray)):
+            source = BytesIO(source)
+        image = open_image(source)
+        if draft_size is not None:
+            image.draft("RGB", draft_size)
+        if maps_source(image.size):
+            return _decode_mapped(image)
+        return image.convert("RGB")
+
+
+def _page_is_source(layout: PosterLayout, image_size: tuple[int, int]) -> bool:
+    # A single borderless page showing the source pixel for pixel needs no resampling.
+    return (
+        layout.page_count == 1
+        and layout.margin_px == 0
+        and layout.scale_x == layout.scale_y == 1.0
+        and layout.offset_x == layout.offset_y == 0
+        and (layout.page_w_px, layout.page_h_px) == image_size
+    )
+
+
+def rasterbate_image(
+    image_bytes,
+    columns: int,
+    rows: int,
+    page_size: str,
+    orientation: str,
+    margin_mm: float,
+    dpi: int,
+    output: BinaryIO | None = None,
+    workers: int | RenderPool | None = None,
+    progress: Callable[[int, int], None] | None = None,
+    style: str = "photo",
+    cell_mm: float = HALFTONE_CELL_MM,
+    shared_image: bool = False,
+    compression: str = "jpeg",
+    quality: int = JPEG_QUALITY,
+    output_format: str = "pdf",
+) -> BinaryIO:
+    """Render the poster as a multi-page PDF or as one image per page.
+
+    `image_bytes` holds the encoded source image, either as bytes or as a
+    binary file object such as an upload spooled by `parse_multipart_stream`.
+    An already decoded Pillow image is used as is, and an `ImagePyramid` from
+    `SourceCache` lets halftone styles start from a reduced level.
+    Pages are encoded and written to `output` one at a time, so peak memory
+    stays around a single page regardless of the grid size. When `output` is
+    omitted the PDF is collected in a `BytesIO` that is rewound before being
+    returned. `workers` opts into rendering pages on a process pool, either
+    a shared `RenderPool` or a number of processes (see `iter_encoded_pages`). Very
+    large sources are decoded to a memory-mapped file (see `load_rgb_image`)
+    and each page reads only the rows it covers.
+    `progress` is called with (pages written, total pages) after every page;
+    an exception raised from it aborts the render.
+
+    `style` selects a photographic poster ("photo") or one of the halftone
+    styles in `HALFTONE_STYLES`, which draw one mark per `cell_mm` cell sized
+    by the darkness of the image underneath. Halftone pages are vector
+    graphics; `workers` only applies to photo posters.
+
+    With `shared_image`, photo posters embed the covered part of the source
+    once, at its native resolution, and every page shows its tile of it
+    through a clip rectangle. The file then stays about the size of one
+    image however many pages there are, and the viewer or printer does the
+    scaling.
+
+    `compression` selects how page images are stored: "jpeg" at `quality`,
+    lossless "flate", or "passthrough", which embeds the original JPEG data
+    wherever no resampling is needed (a shared-image poster, or a page that
+    is exactly the source) and uses JPEG elsewhere.
+
+    `output_format` picks another of `OUTPUT_FORMATS` instead of a PDF: a ZIP
+    archive of PNG or JPEG (at `quality`) page files, or a multi-page TIFF
+    with Deflate-compressed pages. These are written page by page without
+    seeking, like the PDF, and every page is a bitmap, halftone styles
+    included; `shared_image` and `compression` only apply to PDFs.
+    """
+    # Validate the settings against the header before paying for a decode.
+    # Pages are cut at native resolution or upscaled, never downscaled, so the
+    # photo renderer always needs the full-resolution decode.
+    width, height = probe_image_size(image_bytes)
+    layout = plan_poster(width, height, columns, rows, page_size, orientation, margin_mm, dpi)
+    if style != "photo" and style not in HALFTONE_STYLES:
+        raise ValueError("Unsupported style.")
+    if compression not in PDF_COMPRESSIONS:
+        raise ValueError("Unsupported compression.")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unsupported output format.")
+
+    passthrough = None
+    if compression == "passthrough" and style == "photo" and output_format == "pdf":
+        if isinstance(image_bytes, (bytes, bytearray)):
+            passthrough = passthrough_pdf_image(image_bytes)
+        elif hasattr(image_bytes, "read"):
+            image_bytes.seek(0)
+            passthrough = passthrough_pdf_image(image_bytes.read())
+            image_bytes.seek(0)
+
+    if style == "photo":
+        image = load_rgb_image(image_bytes)
+    else:
+        # The halftone grid needs at most one source pixel per cell, so large
+        # JPEGs can be decoded at a fraction of their size, and cached sources
+        # resampled from a reduced pyramid level.
+        grid_size = halftone_grid_size(layout, cell_mm)
+        draft_size = halftone_source_size(layout, grid_size, (width, height))
+        if isinstance(image_bytes, ImagePyramid):
+            source = image_bytes.level_for(draft_size)
+        else:
+            source = load_rgb_image(image_bytes, draft_size=draft_size)
+        image = halftone_grid(source, layout, grid_size, (width, height))
+        del source
+
+    stream = output if output is not None else BytesIO()
+    if output_format != "pdf":
+        _write_page_files(stream, image, layout, output_format, workers, progress, style, quality)
+        if output is None:
+            stream.seek(0)
+        return stream
+
+    writer = PdfStreamWriter(stream)
+    if style == "photo" and shared_image:
+        if passthrough is not None:
+            # The whole original is embedded; the page clips do the cropping.
+            crop_box = (0, 0, image.width, image.height)
+            image_id = writer.add_image(passthrough)
+        else:
+            crop_box = shared_image_crop_box(layout, image.size)
+            with stage("tile"):
+                cropped = image.crop(crop_box)
+            image_id = writer.add_image(encode_pdf_image(cropped, compression, quality))
+        page_w_pt = layout.page_w_px * 72.0 / layout.dpi
+        page_h_pt = layout.page_h_px * 72.0 / layout.dpi
+        for row in range(layout.rows):
+            for col in range(layout.columns):
+                with stage("tile"):
+                    content = shared_image_page_content(layout, crop_box, col, row)
+                writer.add_page(page_w_pt, page_h_pt, content, {"poster": image_id})
+                if progress is not None:
+                    progress(writer.page_count, layout.page_count)
+    elif style == "photo" and passthrough is not None and _page_is_source(layout, image.size):
+        writer.add_image_page(passthrough, layout.dpi)
+        if progress is not None:
+            progress(writer.page_count, layout.page_count)
+    elif style == "photo":
+        encoded_pages = iter_encoded_pages(image, layout, workers, compression=compression, quality=quality)
+        for encoded in encoded_pages:
+            writer.add_image_page(encoded, layout.dpi)
+            if progress is not None:
+                progress(writer.page_count, layout.page_count)
+    else:
+        # Halftone pages are a few thousand shapes each, so they are written as
+        # resolution-independent vector paths rather than page-sized bitmaps.
+        page_w_pt = layout.page_w_px * 72.0 / layout.dpi
+        page_h_pt = layout.page_h_px * 72.0 / layout.dpi
+        for row in range(layout.rows):
+            for col in range(layout.columns):
+                with stage("tile"):
+                    content = halftone_page_content(image, layout, col, row, style)
+                writer.add_page(page_w_pt, page_h_pt, content)
+                if progress is not None:
+                    progress(writer.page_count, layout.page_count)
+    writer.close()
+
+    if output is None:
+        stream.seek(0)
+    return stream
+
+
+def _write_page_files(
+    stream: BinaryIO,
+    image,
+    layout: PosterLayout,
+    output_format: str,
+    workers: int | RenderPool | None,
+    progress: Callable[[int, int], None] | None,
+    style: str,
+    quality: int,
+) -> None:
+    # Writes the non-PDF output formats of `rasterbate_image`.
+    if output_format == "tiff":
+        encode = encode_tiff_page
+    else:
+        image_format = "jpeg" if output_format == "zip-jpeg" else "png"
+        encode = partial(encode_page_file, image_format=image_format, quality=quality, dpi=layout.dpi)
+    pages = iter_encoded_pages(image, layout, workers, style=style, encode=encode)
+
+    if output_format == "tiff":
+        writer = TiffStreamWriter(stream, layout.page_count, layout.dpi)
+        for page in pages:
+            writer.add_page(page)
+            if progress is not None:
+                progress(writer.page_count, layout.page_count)
+        writer.close()
+        return
+
+    # Page files are already compressed, so they are stored as they are. On a
+    # stream that cannot seek, such as a socket, zipfile writes each entry's
+    # sizes in a data descriptor after its data instead of going back to the
+    # local header.
+    extension = "." + image_format.replace("jpeg", "jpg")
+    with zipfile.ZipFile(stream, "w", zipfile.ZIP_STORED) as archive:
+        for index, data in enumerate(pages):
+            row, col = divmod(index, layout.columns)
+            archive.writestr(f"row-{row + 1:02d}-col-{col + 1:02d}{extension}", data)
+            if progress is not None:
+                progress(index + 1, layout.page_count)
+
+
+def result_cache_key(image_digest: str, **settings) -> str:
+    """Return the cache key for a render of the image with the given settings.
+
+    Settings must already be normalized (for example the effective DPI rather
+    than the requested one) so that equivalent requests share a key.
+    """
+    payload = json.dumps({"image": image_digest, **settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RangeNotSatisfiableError(ValueError):
+    """Raised for a Range header that starts beyond the end of the resource."""
+
+
+def parse_byte_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Return the inclusive (first, last) byte positions asked for by a `Range` header.
+
+    Returns None when the whole resource should be sent: without a header,
+    for one that is malformed, and for several ranges, which are answered in
+    full rather than as multipart/byteranges. Raises
+    `RangeNotSatisfiableError` when the range lies beyond the end.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    first, separator, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or not separator or "," in spec:
+        return None
+    if not all(part.isdigit() for part in (first, last) if part) or not (first or last):
+        return None
+    if not first:
+        # A suffix range: the last `last` bytes.
+        if int(last) == 0 or size == 0:
+            raise RangeNotSatisfiableError(f"bytes */{size}")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiableError(f"bytes */{size}")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class _CacheEntryWriter:
+    """Collect a result being rendered and publish it to the cache on commit."""
+
+    def __init__(self, cache: "ResultCache", name: str, file) -> None:
+        self._cache = cache
+        self._name = name
+        self._file = file
+        self._memory: bytearray | None = bytearray() if cache.max_memory_item_bytes > 0 else None
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self._file is not None:
+            self._file.write(data)
+        if self._memory is not None:
+            self._memory += data
+            if len(self._memory) > self._cache.max_memory_item_bytes:
+                self._memory = None
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def commit(self) -> None:
+        data = bytes(self._memory) if self._memory is not None else None
+        self._cache._publish(self._name, self._file, data, self.size)  # pylint: disable=protected-access
+        self._file = None
+
+    def discard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            os.unlink(self._file.name)
+            self._file = None
+
+
+# File extensions of cached results: every output format and both preview formats.
+RESULT_SUFFIXES = tuple(dict.fromkeys([extension for _, extension in OUTPUT_FORMATS.values()] + [".jpg", ".png"]))
+
+
+class ResultCache:
+    """Content-addressed cache of rendered results.
+
+    Results are stored as files under `directory`, which is trimmed back to
+    `max_disk_bytes` by evicting the least recently used entries. Results of
+    up to `max_memory_item_bytes` are also kept in an in-memory LRU limited
+    to `max_memory_bytes`. Either layer is disabled by a zero budget.
+
+    Each entry is stored under its key plus a file extension from `suffixes`
+    that records what kind of file it is, and is only found again under that
+    extension. The first of `suffixes` is the default.
+
+    Several processes may share `directory`: an entry another process stored
+    is picked up the first time it is asked for, and each process trims the
+    directory to the budget over the entries it knows of.
+    """
+
+    def __init__(
+        self,
+        directory: str | None,
+        max_disk_bytes: int,
+        max_memory_bytes: int,
+        max_memory_item_bytes: int = 8 * 1024 * 1024,
+        suffixes: tuple[str, ...] = RESULT_SUFFIXES,
+    ) -> None:
+        self.directory = directory if directory and max_disk_bytes > 0 else None
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.max_memory_item_bytes = min(max_memory_item_bytes, max_memory_bytes)
+        self.suffixes = suffixes
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_size = 0
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    # Entries are indexed by file name, which is their key plus extension.
+    def _name(self, key: str, suffix: str | None) -> str:
+        if suffix is None:
+            return key + self.suffixes[0]
+        if suffix not in self.suffixes:
+            raise ValueError(f"Unsupported cache entry type {suffix!r}")
+        return key + suffix
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffixes):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def open(self, key: str, suffix: str | None = None) -> BinaryIO | None:
+        """Return a readable file object for a result stored with `suffix`, or None on a miss."""
+        name = self._name(key, suffix)
+        with self._lock:
+            data = self._memory.get(name)
+            if data is not None:
+                self._memory.move_to_end(name)
+                return BytesIO(data)
+            if name not in self._disk and not self._adopt_locked(key, name):
+                return None
+            self._disk.move_to_end(name)
+        path = self._path(name)
+        try:
+            handle = open(path, "rb")
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._disk_size -= self._disk.pop(name, 0)
+            return None
+        return handle
+
+    def _adopt_locked(self, key: str, name: str) -> bool:
+        # Keys are hex digests; anything else could name a path outside the directory.
+        if self.directory is None or not key or key.strip("0123456789abcdef"):
+            return False
+        try:
+            size = os.stat(self._path(name)).st_size
+        except OSError:
+            return False
+        self._disk[name] = size
+        self._disk_size += size
+        return True
+
+    def create_entry(self, key: str, suffix: str | None = None) -> _CacheEntryWriter:
+        """Return a writer that stores a new result under `key` and `suffix` once committed."""
+        name = self._name(key, suffix)
+        file = None
+        if self.directory is not None:
+            file = NamedTemporaryFile(dir=self.directory, prefix=".tmp-", delete=False)
+        return _CacheEntryWriter(self, name, file)
+
+    def _publish(self, name: str, file, data: bytes | None, size: int) -> None:
+        if file is not None:
+            file.close()
+            if size > self.max_disk_bytes:
+                os.unlink(file.name)
+            else:
+                os.replace(file.name, self._path(name))
+                with self._lock:
+                    self._disk_size += size - self._disk.pop(name, 0)
+                    self._disk[name] = size
+                    self._evict_disk()
+        if data is not None:
+            with self._lock:
+                self._memory_size += len(data) - len(self._memory.pop(name, b""))
+                self._memory[name] = data
+                while self._memory_size > self.max_memory_bytes:
+                    _, evicted = self._memory.popitem(last=False)
+                    self._memory_size -= len(evicted)
+
+    def _evict_disk(self) -> None:
+        while self._disk_size > self.max_disk_bytes and self._disk:
+            name, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.unlink(self._path(name))
+            except FileNotFoundError:
+                pass
+
+
+class ImagePyramid:
+    """A decoded RGB image with power-of-two reductions built on demand.
+
+    Level 0 is the image itself and level k is 2**k times smaller in each
+    dimension, made with Pillow's box `reduce` from the nearest larger level
+    that has been built, so a small level of a memory-mapped source never
+    needs the large ones in between. Consumers
+    that downsample, such as the halftone grid, resample from the smallest
+    level that still has the resolution they need instead of from the full
+    image. `on_grow` is called with the size in bytes of every new level so
+    that a cache can account for it.
+    """
+
+    # Levels are not reduced below this many pixels on their shorter side.
+    min_level_px = 64
+
+    def __init__(self, image, on_grow: Callable[[int], None] | None = None) -> None:
+        self.base = image
+        self.on_grow = on_grow
+        self._levels = {0: image}
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.base.size
+
+    @property
+    def width(self) -> int:
+        return self.base.width
+
+    @property
+    def height(self) -> int:
+        return self.base.height
+
+    @property
+    def footprint(self) -> int:
+        # Pillow keeps RGB pixels in four bytes.
+        return sum(level.width * level.height * 4 for level in self._levels.values())
+
+    def level_for(self, min_size: tuple[int, int]):
+        """Return the smallest level at least `min_size` pixels wide and high."""
+        min_w, min_h = min_size
+        index, (width, height) = 0, self.base.size
+        while True:
+            next_w, next_h = width // 2, height // 2
+            if next_w < min_w or next_h < min_h or min(next_w, next_h) < self.min_level_px:
+                break
+            # `reduce` rounds partial blocks up.
+            index, width, height = index + 1, (width + 1) // 2, (height + 1) // 2
+        with self._lock:
+            level = self._levels.get(index)
+            if level is None:
+                nearest = max(known for known in self._levels if known < index)
+                level = self._levels[index] = self._levels[nearest].reduce(2 ** (index - nearest))
+                if self.on_grow is not None:
+                    self.on_grow(level.width * level.height * 4)
+            return level
+
+
+class SourceCache:
+    """Memory-bounded LRU of decoded, RGB-converted source images.
+
+    Sources are keyed by the SHA-256 digest of their encoded bytes, which also
+    serves as the public image id, and kept as `ImagePyramid`s whose reduced
+    levels count against the same memory bound as the full images. The
+    encoded uploads are kept in `store` (when given) so that a source evicted
+    from memory can be decoded again instead of having to be uploaded a
+    second time.
+    """
+
+    def __init__(self, max_bytes: int, store: ResultCache | None = None) -> None:
+        self.max_bytes = max_bytes
+        self.store = store
+        self._lock = threading.Lock()
+        self._images: OrderedDict = OrderedDict()
+        self._footprints: dict = {}
+        self._size = 0
+
+    def peek(self, image_id: str) -> ImagePyramid | None:
+        """Return the source for `image_id` if it is decoded in memory, without decoding it."""
+        with self._lock:
+            pyramid = self._images.get(image_id)
+            if pyramid is not None:
+                self._images.move_to_end(image_id)
+            return pyramid
+
+    def get(self, image_id: str) -> ImagePyramid | None:
+        """Return the decoded source for `image_id`, or None if it is unknown."""
+        pyramid = self.peek(image_id)
+        if pyramid is not None:
+            return pyramid
+        if self.store is None:
+            return None
+        encoded = self.store.open(image_id)
+        if encoded is None:
+            return None
+        with encoded:
+            return self._insert(image_id, load_rgb_image(encoded))
+
+    def add(self, image_id: str, encoded: BinaryIO) -> ImagePyramid:
+        """Decode and remember an uploaded image, returning the decoded source."""
+        pyramid = self.get(image_id)
+        if pyramid is not None:
+            return pyramid
+        image = load_rgb_image(encoded)
+        encoded.seek(0)
+        self.remember(image_id, encoded)
+        return self._insert(image_id, image)
+
+    def open_encoded(self, image_id: str) -> BinaryIO | None:
+        """Open the stored upload for `image_id`, or return None if it is not kept."""
+        return self.store.open(image_id) if self.store is not None else None
+
+    def remember(self, image_id: str, encoded: BinaryIO) -> bool:
+        """Keep the encoded upload so `get` can decode it later; False without a store."""
+        if self.store is None:
+            return False
+        existing = self.store.open(image_id)
+        if existing is not None:
+            existing.close()
+            return True
+        entry = self.store.create_entry(image_id)
+        shutil.copyfileobj(encoded, entry)
+        entry.commit()
+        return True
+
+    def _insert(self, image_id: str, image) -> ImagePyramid:
+        pyramid = ImagePyramid(image)
+        size = pyramid.footprint
+        if size > self.max_bytes:
+            return pyramid
+        with self._lock:
+            existing = self._images.get(image_id)
+            if existing is not None:
+                return existing
+            self._images[image_id] = pyramid
+            self._footprints[image_id] = size
+            self._size += size
+            self._evict_locked()
+        pyramid.on_grow = lambda grown: self._grown(image_id, pyramid, grown)
+        return pyramid
+
+    def _grown(self, image_id: str, pyramid: ImagePyramid, grown: int) -> None:
+        with self._lock:
+            # Levels built after the pyramid was evicted are not accounted for.
+            if self._images.get(image_id) is pyramid:
+                self._footprints[image_id] += grown
+                self._size += grown
+                self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        while self._size > self.max_bytes and self._images:
+            image_id, _ = self._images.popitem(last=False)
+            self._size -= self._footprints.pop(image_id)
+
+
+class TeeWriter:
+    """Write the same bytes to several binary streams."""
+
+    def __init__(self, *streams) -> None:
+        self._streams = streams
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        for stream in self._streams:
+            stream.write(data)
+        return len(data)
+
+    def flush(self) -> None:
+        for stream in self._streams:
+            stream.flush()
+
+
+class JobCancelledError(Exception):
+    """Raised inside a background render once its job has been cancelled."""
+
+
+class RenderJob:
+    """State of one background render, updated by the thread running it."""
+
+    def __init__(self, job_id: str, pages_total: int, result_path: str, output_format: str = "pdf") -> None:
+        self.id = job_id
+        self.status = "queued"
+        self.pages_done = 0
+        self.pages_total = pages_total
+        self.error: str | None = None
+        self.result_path = result_path
+        self.output_format = output_format
+        self.finished_at: float | None = None
+        self.future = None
+        self.cancel_requested = threading.Event()
+        # Called after every progress update, by `JobManager` in shared mode.
+        self.on_progress: Callable[[RenderJob], None] | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in {"done", "failed", "cancelled"}
+
+    def report_progress(self, pages_done: int, pages_total: int) -> None:
+        """Progress callback for `rasterbate_image`; raises once the job is cancelled."""
+        if self.cancel_requested.is_set():
+            raise JobCancelledError()
+        self.pages_done = pages_done
+        self.pages_total = pages_total
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+    def to_dict(self) -> dict:
+        state = {
+            "id": self.id,
+            "status": self.status,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+        }
+        if self.error:
+            state["error"] = self.error
+        return state
+
+
+class JobManager:
+    """Run renders in the background on a bounded thread pool.
+
+    `render(job, output)` callables write their result to a file owned by the
+    job. At most `max_pending` jobs may be queued or running. Finished jobs,
+    and their result files, are forgotten `result_ttl` seconds after they
+    complete.
+
+    With `shared`, several server processes use the same `directory`: each
+    job's state is also written to `<id>.json` there, so any process can
+    report on it, serve its result or delete it, and cancellation is passed
+    to the owning process through a `<id>.cancel` file. Results left from an
+    earlier run are then not removed on startup; call `remove_orphans` once
+    before the processes start instead.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        workers: int = 1,
+        max_pending: int = 16,
+        result_ttl: float = 3600.0,
+        shared: bool = False,
+    ) -> None:
+        self.directory = directory
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.shared = shared
+        self._jobs: dict[str, RenderJob] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rasterbator-job")
+        if not shared:
+            self.remove_orphans(directory)
+
+    @staticmethod
+    def remove_orphans(directory: str) -> None:
+        """Delete job results and state left in `directory` by an earlier run."""
+        os.makedirs(directory, exist_ok=True)
+        # Job state lives in memory, so results left by an earlier run are orphans.
+        extensions = tuple({extension for _, extension in OUTPUT_FORMATS.values()} | {".json", ".cancel"})
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(extensions):
+                os.unlink(entry.path)
+
+    def submit(
+        self,
+        render: Callable[[RenderJob, BinaryIO], None],
+        pages_total: int,
+        output_format: str = "pdf",
+    ) -> RenderJob | None:
+        """Queue a render and return its job, or None when too many jobs are pending."""
+        with self._lock:
+            self._expire_locked()
+            if sum(not job.finished for job in self._jobs.values()) >= self.max_pending:
+                return None
+            job_id = secrets.token_urlsafe(16)
+            result_path = os.path.join(self.directory, job_id + OUTPUT_FORMATS[output_format][1])
+            job = RenderJob(job_id, pages_total, result_path, output_format)
+            if self.shared:
+                job.on_progress = self._progressed
+            self._jobs[job_id] = job
+            self._save(job)
+            job.future = self._pool.submit(self._run, job, render)
+        return job
+
+    def get(self, job_id: str) -> RenderJob | None:
+        with self._lock:
+            self._expire_locked()
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def cancel(self, job_id: str) -> RenderJob | None:
+        """Cancel a queued or running job; finished jobs are deleted instead."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return self._cancel_elsewhere(job_id)
+            if job.finished:
+                del self._jobs[job_id]
+                self._remove_result(job)
+                self._remove_state(job)
+                return job
+            job.cancel_requested.set()
+            if job.future is not None and job.future.cancel():
+                job.status = "cancelled"
+                job.finished_at = time.monotonic()
+                self._save(job)
+        return job
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, job_id + suffix)
+
+    def _save(self, job: RenderJob) -> None:
+        if not self.shared:
+            return
+        state = {**job.to_dict(), "output_format": job.output_format, "owner": os.getpid()}
+        path = self._path(job.id, ".json")
+        temporary = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(state, file)
+        os.replace(temporary, path)
+
+    def _load(self, job_id: str) -> RenderJob | None:
+        # A read-only view of a job owned by another process.
+        if not self.shared or not job_id or not all(char.isalnum() or char in "-_" for char in job_id):
+            return None
+        path = self._path(job_id, ".json")
+        try:
+            with open(path, encoding="utf-8") as file:
+                state = json.load(file)
+            saved_at = os.path.getmtime(path)
+        except (OSError, ValueError):
+            return None
+        output_format = state["output_format"]
+        job = RenderJob(job_id, state["pages_total"], self._path(job_id, OUTPUT_FORMATS[output_format][1]), output_format)
+        job.status = state["status"]
+        job.pages_done = state["pages_done"]
+        job.error = state.get("error")
+        if not job.finished:
+            try:
+                os.kill(state["owner"], 0)
+            except ProcessLookupError:
+                job.status = "failed"
+                job.error = "The server process rendering this job has exited."
+            except PermissionError:
+                pass
+        if job.finished and saved_at < time.time() - self.result_ttl:
+            self._remove_result(job)
+            self._remove_state(job)
+            return None
+        return job
+
+    def _cancel_elsewhere(self, job_id: str) -> RenderJob | None:
+        job = self._load(job_id)
+        if job is None:
+            return None
+        if job.finished:
+            self._remove_result(job)
+            self._remove_state(job)
+        else:
+            with open(self._path(job_id, ".cancel"), "w", encoding="utf-8"):
+                pass
+        return job
+
+    def _progressed(self, job: RenderJob) -> None:
+        if os.path.exists(self._path(job.id, ".cancel")):
+            job.cancel_requested.set()
+        self._save(job)
+
+    def _remove_state(self, job: RenderJob) -> None:
+        if not self.shared:
+            return
+        for suffix in (".json", ".cancel"):
+            try:
+                os.unlink(self._path(job.id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _run(self, job: RenderJob, render) -> None:
+        job.status = "running"
+        if self.shared:
+            self._progressed(job)
+        try:
+            if job.cancel_requested.is_set():
+                raise JobCancelledError()
+            with open(job.result_path, "wb") as output:
+                render(job, output)
+        except JobCancelledError:
+            job.status = "cancelled"
+            self._remove_result(job)
+        except Exception as exc:  # pylint: disable=broad-except
+            job.status = "failed"
+            job.error = str(exc)
+            self._remove_result(job)
+        else:
+            job.pages_done = job.pages_total
+            job.status = "done"
+        finally:
+            job.finished_at = time.monotonic()
+            self._save(job)
+
+    def _expire_locked(self) -> None:
+        deadline = time.monotonic() - self.result_ttl
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at < deadline:
+                del self._jobs[job_id]
+                self._remove_result(job)
+                self._remove_state(job)
+
+    @staticmethod
+    def _remove_result(job: RenderJob) -> None:
+        try:
+            os.unlink(job.result_path)
+        except FileNotFoundError:
+            pass
+
+    def cancel_all(self) -> None:
+        """Cancel every queued or running job."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.finished:
+                    continue
+                job.cancel_requested.set()
+                if job.future is not None and job.future.cancel():
+                    job.status = "cancelled"
+                    job.finished_at = time.monotonic()
+                    self._save(job)
+
+    def shutdown(self, cancel: bool = True) -> None:
+        """Stop the job threads; without `cancel`, pending jobs are finished first."""
+        if cancel:
+            self.cancel_all()
+        self._pool.shutdown(wait=True, cancel_futures=cancel)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+
+def _format_labels(labels: tuple) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+class Metrics:
+    """Thread-safe request counters, gauges and histograms for `/metrics`.
+
+    `render` produces the Prometheus text exposition format, so the endpoint
+    can be scraped directly without a client library.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._requests: dict = {}
+        self._histograms: dict = {}
+        self._renders_in_flight = 0
+
+    def _observe(self, name: str, labels: tuple, buckets, value: float) -> None:
+        histogram = self._histograms.get((name, labels))
+        if histogram is None:
+            histogram = self._histograms[(name, labels)] = _Histogram(buckets)
+        histogram.observe(value)
+
+    def count_request(self, method: str, route: str, status: int, seconds: float) -> None:
+        with self._lock:
+            key = (("method", method), ("route", route), ("status", str(status)))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._observe("rasterbator_request_duration_seconds", (("route", route),), LATENCY_BUCKETS, seconds)
+
+    def observe_upload(self, size: int) -> None:
+        with self._lock:
+            self._observe("rasterbator_upload_bytes", (), UPLOAD_SIZE_BUCKETS, size)
+
+    def observe_stages(self, timings: dict) -> None:
+        """Record one request's (or job's) time in each pipeline stage."""
+        with self._lock:
+            for name, seconds in timings.items():
+                self._observe("rasterbator_stage_seconds", (("stage", name),), LATENCY_BUCKETS, seconds)
+
+    @contextmanager
+    def track_render(self):
+        """Count a render as in flight for the duration of the block."""
+        with self._lock:
+            self._renders_in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._renders_in_flight -= 1
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                "# HELP rasterbator_requests_total HTTP requests handled.",
+                "# TYPE rasterbator_requests_total counter",
+            ]
+            for labels, count in sorted(self._requests.items()):
+                lines.append(f"rasterbator_requests_total{{{_format_labels(labels)}}} {count}")
+            lines += [
+                "# HELP rasterbator_renders_in_flight Renders currently running, including background jobs.",
+                "# TYPE rasterbator_renders_in_flight gauge",
+                f"rasterbator_renders_in_flight {self._renders_in_flight}",
+            ]
+            help_texts = {
+                "rasterbator_request_duration_seconds": "Time to handle an HTTP request.",
+                "rasterbator_stage_seconds": "Time spent in each render pipeline stage per request or job.",
+                "rasterbator_upload_bytes": "Size of uploaded images.",
+            }
+            for name, help_text in help_texts.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (metric, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        bucket_labels = _format_labels(labels + (("le", f"{bound:g}"),))
+                        lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+                    bucket_labels = _format_labels(labels + (("le", "+Inf"),))
+                    lines.append(f"{name}_bucket{{{bucket_labels}}} {histogram.count}")
+                    suffix = f"{{{_format_labels(labels)}}}" if labels else ""
+                    lines.append(f"{name}_sum{suffix} {histogram.total:g}")
+                    lines.append(f"{name}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+class ChunkedResponseWriter:
+    """File-like object that frames writes with HTTP/1.1 chunked transfer coding.
+
+    Small writes are coalesced into chunks of roughly `chunk_size` bytes. The
+    `on_start` callback runs right before the first chunk goes out, which lets
+    the handler defer sending response headers until output actually exists;
+    anything that fails before then can still be reported as a normal error.
+    """
+
+    def __init__(self, wfile: BinaryIO, on_start=None, chunk_size: int = 64 * 1024) -> None:
+        self._wfile = wfile
+        self._on_start = on_start
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self.started = False
+        self.closed = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("write to closed chunked response")
+        size = len(data)
+        if not size:
+            return 0
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self._send_chunk()
+        return size
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._send_chunk()
+
+    def close(self, trailers: dict | None = None) -> None:
+        """Send any buffered bytes followed by the terminating zero-length chunk.
+
+        `trailers` are sent as trailer fields after the last chunk; the
+        response headers should announce them with a `Trailer` header.
+        """
+        if self.closed:
+            return
+        self.flush()
+        self._start()
+        fields = "".join(f"{name}: {value}\r\n" for name, value in (trailers or {}).items())
+        self._wfile.write(b"0\r\n" + fields.encode("latin-1") + b"\r\n")
+        self.closed = True
+
+    def _start(self) -> None:
+        if not self.started:
+            self.started = True
+            if self._on_start is not None:
+                self._on_start()
+
+    def _send_chunk(self) -> None:
+        self._start()
+        self._wfile.write(b"%X\r\n" % len(self._buffer) + self._buffer + b"\r\n")
+        self._buffer.clear()
+
+
+class RenderGate:
+    """Bound concurrent renders, the memory they use, and the requests waiting.
+
+    At most `slots` renders run at once, and when `memory_budget` is set their
+    estimated memory use (see `estimate_render_cost`) stays within it; a render
+    larger than the whole budget may still run once nothing else is. Up to
+    `max_waiting` further requests may wait for room; beyond that `acquire`
+    fails immediately so the caller can turn the request away.
+    """
+
+    def __init__(self, slots: int, max_waiting: int, memory_budget: int | None = None) -> None:
+        self.memory_budget = memory_budget
+        self._condition = threading.Condition()
+        self._free_slots = slots
+        self._memory_in_use = 0
+        self._max_waiting = max_waiting
+        self._waiting = 0
+
+    def _fits(self, memory_bytes: int) -> bool:
+        if self._free_slots < 1:
+            return False
+        if self.memory_budget is None or self._memory_in_use == 0:
+            return True
+        return self._memory_in_use + memory_bytes <= self.memory_budget
+
+    def acquire(self, timeout: float | None = None, memory_bytes: int = 0, limit_waiting: bool = True) -> bool:
+        """Take a render slot and `memory_bytes` of the budget, waiting up to `timeout`.
+
+        Callers whose queue is bounded elsewhere, such as background jobs, pass
+        `limit_waiting=False` so they never count against `max_waiting`.
+        """
+        with self._condition:
+            if not self._fits(memory_bytes):
+                if limit_waiting and self._waiting >= self._max_waiting:
+                    return False
+                waiting = 1 if limit_waiting else 0
+                self._waiting += waiting
+                try:
+                    if not self._condition.wait_for(lambda: self._fits(memory_bytes), timeout):
+                        return False
+                finally:
+                    self._waiting -= waiting
+            self._free_slots -= 1
+            self._memory_in_use += memory_bytes
+            return True
+
+    def release(self, memory_bytes: int = 0) -> None:
+        with self._condition:
+            self._free_slots += 1
+            self._memory_in_use -= memory_bytes
+            self._condition.notify_all()
+
+
+class ClientLimiter:
+    """Limit how many renders and unfinished jobs each client may have at once."""
+
+    def __init__(self, max_per_client: int) -> None:
+        self.max_per_client = max_per_client
+        self._lock = threading.Lock()
+        self._active: dict = {}
+
+    def acquire(self, client: str) -> bool:
+        with self._lock:
+            active = self._active.get(client, 0)
+            if active >= self.max_per_client:
+                return False
+            self._active[client] = active + 1
+            return True
+
+    def release(self, client: str) -> None:
+        with self._lock:
+            active = self._active.pop(client) - 1
+            if active:
+                self._active[client] = active
+
+
+class BoundedThreadingHTTPServer(HTTPServer):
+    """HTTP server that handles connections on a fixed-size thread pool.
+
+    At most `max_queued` accepted connections wait for a free thread; further
+    connections are answered with 503 and closed without being read.
+    Renders are additionally throttled through `render_gate`, which should
+    allow fewer renders (running plus queued) than there are workers so that
+    page loads always find a free thread. Given a `render_pool`, renders
+    spread their pages over its processes; it is shut down with the server.
+
+    Given a `listen_socket`, the server accepts on that already listening
+    socket instead of binding its own, so that several processes can share
+    it. After `max_requests` requests it stops accepting, lets background
+    jobs finish and returns from `serve_forever`, so a supervisor can
+    replace the process.
+    """
+
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        server_address,
+        handler_class,
+        workers: int,
+        render_gate: RenderGate,
+        result_cache: ResultCache | None = None,
+        source_cache: SourceCache | None = None,
+        jobs: JobManager | None = None,
+        metrics: Metrics | None = None,
+        client_limiter: ClientLimiter | None = None,
+        listen_socket: socket.socket | None = None,
+        max_requests: int = 0,
+        max_queued: int = HTTP_QUEUE,
+        render_pool: RenderPool | None = None,
+    ) -> None:
+        super().__init__(server_address, handler_class, bind_and_activate=listen_socket is None)
+        if listen_socket is not None:
+            self.socket.close()
+            self.socket = listen_socket
+            self.server_address = listen_socket.getsockname()
+        self.max_requests = max_requests
+        self._requests = 0
+        self._cancel_jobs = True
+        self.render_gate = render_gate
+        self.result_cache = result_cache
+        self.source_cache = source_cache
+        self.jobs = jobs
+        self.metrics = metrics
+        self.client_limiter = client_limiter
+        self.render_pool = render_pool
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rasterbator")
+        self._connections = threading.BoundedSemaphore(workers + max_queued)
+
+    def process_request(self, request, client_address) -> None:
+        if not self._connections.acquire(blocking=False):
+            self._reject_request(request)
+            return
+        self._pool.submit(self._process_request_thread, request, client_address)
+        self._requests += 1
+        if self.max_requests and self._requests == self.max_requests:
+            self.stop(cancel_jobs=False)
+
+    def stop(self, cancel_jobs: bool = True) -> None:
+        """Make `serve_forever` return; safe to call from any thread or a signal handler.
+
+        `server_close` then waits for the requests in flight. Background jobs
+        are cancelled unless `cancel_jobs` is false, in which case they are
+        finished first.
+        """
+        if cancel_jobs and self.jobs is not None:
+            self.jobs.cancel_all()
+        self._cancel_jobs = self._cancel_jobs and cancel_jobs
+        threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def _process_request_thread(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:  # pylint: disable=broad-except
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._connections.release()
+
+    _busy_response = (
+        b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 1\r\nConnection: close\r\n\r\n"
+    )
+
+    def _reject_request(self, request) -> None:
+        # Runs on the accepting thread, so the reply must never block it.
+        try:
+            request.setblocking(False)
+            request.send(self._busy_response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+        if self.metrics is not None:
+            self.metrics.count_request("-", "other", 503, 0.0)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self.jobs is not None:
+            self.jobs.shutdown(cancel=self._cancel_jobs)
+        self._pool.shutdown(wait=True)
+        if self.render_pool is not None:
+            self.render_pool.shutdown()
+
+
+class PreforkSupervisor:
+    """Serve from `processes` forked workers that accept on one listening socket.
+
+    `serve(listen_socket)` runs in each worker and returns when the worker
+    should exit. Workers that exit, whether they crashed or were recycled
+    after their request limit, are replaced. SIGTERM or SIGINT is passed on
+    to the workers as SIGTERM, and `run` returns once they have all exited.
+    """
+
+    # Seconds to wait before replacing a worker that exited this soon after it
+    # started, so that one failing on startup is not restarted in a busy loop.
+    restart_delay = 1.0
+
+    _signals = (signal.SIGTERM, signal.SIGINT)
+
+    def __init__(self, listen_socket: socket.socket, processes: int, serve: Callable[[socket.socket], None]) -> None:
+        self.listen_socket = listen_socket
+        self.processes = processes
+        self.serve = serve
+        self._workers: dict[int, float] = {}
+        self._stopping = False
+
+    def run(self) -> None:
+        previous = {signum: signal.signal(signum, self._stop) for signum in self._signals}
+        try:
+            while self._workers or not self._stopping:
+                while not self._stopping and len(self._workers) < self.processes:
+                    self._spawn()
+                pid, status = os.wait()
+                started = self._workers.pop(pid, None)
+                if started is None or self._stopping:
+                    continue
+                code = os.waitstatus_to_exitcode(status)
+                if code:
+                    print(f"Worker {pid} exited with status {code}, starting another", file=sys.stderr)
+                if time.monotonic() - started < self.restart_delay:
+                    time.sleep(self.restart_delay)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def _spawn(self) -> None:
+        # Hold signals until the new pid is recorded, so `_stop` cannot miss it.
+        signal.pthread_sigmask(signal.SIG_BLOCK, self._signals)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                # Ctrl+C reaches the whole process group; the supervisor passes it on.
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, self._signals)
+                self.serve(self.listen_socket)
+                code = 0
+            except BaseException:  # pylint: disable=broad-except
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self._workers[pid] = time.monotonic()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, self._signals)
+
+    def _stop(self, signum, frame) -> None:  # pylint: disable=unused-argument
+        self._stopping = True
+        for pid in self._workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class RasterbatorHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 is required for chunked responses. Every response also sends
+    # `Connection: close`, so each connection still carries a single request.
+    protocol_version = "HTTP/1.1"
+
+    # Socket timeout so stalled clients cannot hold a worker thread forever.
+    timeout = 60
+
+    # Seconds a render request may wait for a free render slot.
+    render_wait_timeout = 30.0
+
+    # Stream PDFs with chunked transfer coding to HTTP/1.1 clients instead of
+    # buffering the whole document to compute Content-Length.
+    stream_pdf = True
+
+    # Largest request body accepted by the multipart parser.
+    max_upload_bytes = MAX_UPLOAD_BYTES
+
+    # Seconds a client may take to send a whole request body.
+    upload_timeout = UPLOAD_TIMEOUT_SECONDS
+
+    # Largest poster, in pixels across all pages, a single request may ask for.
+    max_render_pixels = MAX_RENDER_MEGAPIXELS * 1_000_000
+
+    # Most CPU seconds a single render may be estimated to need.
+    max_render_seconds = MAX_RENDER_SECONDS
+
+    # Identify clients by the address a reverse proxy appends to
+    # X-Forwarded-For rather than by the connection's peer address.
+    trust_proxy = False
+
+    # Cache-Control sent with the landing page.
+    page_cache_control = "public, max-age=600"
+
+    # Routes reported as metric labels; other paths are counted as "other".
+    metric_routes = frozenset({"/", "/rasterbate", "/images", "/jobs", "/metrics", "/preview"})
+
+    def handle_one_request(self) -> None:
+        # Every request records its pipeline stages for Server-Timing and /metrics.
+        self._started = time.perf_counter()
+        self._status = None
+        with record_stages() as self._stage_timings:
+            super().handle_one_request()
+        metrics = getattr(self.server, "metrics", None)
+        if metrics is not None and self._status is not None:
+            elapsed = time.perf_counter() - self._started
+            metrics.count_request(self.command or "-", self._metric_route(), self._status, elapsed)
+            if self._stage_timings:
+                metrics.observe_stages(self._stage_timings)
+
+    def send_response(self, code: int, message: str | None = None) -> None:
+        self._status = code
+        super().send_response(code, message)
+
+    def _metric_route(self) -> str:
+        path = urlsplit(self.path or "").path
+        if path.startswith("/jobs/"):
+            return "/jobs/{id}/result" if path.endswith("/result") else "/jobs/{id}"
+        if path.startswith("/results/"):
+            return "/results/{key}"
+        return path if path in self.metric_routes else "other"
+
+    def do_GET(self) -> None:  # noqa: N802 - name required by BaseHTTPRequestHandler
+        path = urlsplit(self.path).path
+        if path.startswith("/jobs/"):
+            self._handle_job_get(path)
+            return
+        if path == "/metrics":
+            self._send_metrics()
+            return
+        if path == "/preview":
+            self._send_preview(urlsplit(self.path).query)
+            return
+        if path.startswith("/results/"):
+            self._send_stored_result(path)
+            return
+        self._send_static(landing_page(), self.page_cache_control)
+
+    def _send_stored_result(self, path: str, include_body: bool = True) -> None:
+        """Serve a cached render under the stable URL sent as its Content-Location."""
+        key, extension = os.path.splitext(path[len("/results/"):])
+        output_format = next((name for name, (_, ext) in OUTPUT_FORMATS.items() if ext == extension), None)
+        cache = getattr(self.server, "result_cache", None)
+        result = cache.open(key, extension) if cache is not None and output_format is not None else None
+        if result is None:
+            self.send_error(404, "Unknown or expired result")
+            return
+        with result:
+            self._send_download(result, output_format, f'"{key}"', include_body)
+
+    def _send_download(self, result: BinaryIO, output_format: str, etag: str, include_body: bool = True) -> None:
+        """Send a stored result, or the part of it asked for by a Range request.
+
+        A Range is honoured only while an If-Range validator still matches
+        `etag`, so a resumed download never mixes two different results.
+        Files go out with `socket.sendfile`, which lets the kernel copy them to
+        the socket without passing through Python.
+        """
+        size = result.seek(0, os.SEEK_END)
+        if self._if_none_match(etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return
+        try:
+            if_range = self.headers.get("If-Range")
+            byte_range = parse_byte_range(self.headers.get("Range"), size) if if_range in {None, etag} else None
+        except RangeNotSatisfiableError as exc:
+            self.send_response(416)
+            self.send_header("Content-Range", str(exc))
+            self.send_header("Content-Length", "0")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return
+
+        start, end = byte_range if byte_range is not None else (0, size - 1)
+        content_type, extension = OUTPUT_FORMATS[output_format]
+        self.send_response(200 if byte_range is None else 206)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        if byte_range is not None:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "private, max-age=86400")
+        self.send_header("Content-Disposition", f"attachment; filename=poster{extension}")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if not include_body:
+            return
+        if isinstance(result, BytesIO):
+            self.wfile.write(result.getbuffer()[start : end + 1])
+        else:
+            self.connection.sendfile(result, start, end - start + 1)
+
+    def _send_preview(self, query: str) -> None:
+        """Send a small JPEG or PNG of the poster for an image uploaded to /images.
+
+        Previews are cached like PDFs, keyed by image and layout, and are
+        immutable for a given URL, so browsers may cache them too.
+        """
+        fields = {name: values[-1] for name, values in parse_qs(query).items()}
+        source_cache = getattr(self.server, "source_cache", None)
+        image_id = fields.get("image_id", "")
+        found = self._find_source(image_id)
+        if found is None:
+            self.send_error(404, "Unknown image id; upload the image to /images first")
+            return
+        source, image_size = found
+
+        try:
+            settings = parse_render_settings(fields)
+            layout = plan_poster_for_settings(*image_size, settings)
+            size = max(16, min(PREVIEW_SIZE_MAX, int(fields.get("size", PREVIEW_SIZE))))
+            image_format = fields.get("format", "jpeg").lower()
+            if image_format not in {"jpeg", "png"}:
+                raise ValueError("Preview format must be jpeg or png")
+        except Exception as exc:  # pylint: disable=broad-except
+            self.send_error(400, f"Failed to preview image: {exc}")
+            return
+
+        geometry = {name: settings[name] for name in ("columns", "rows", "page_size", "orientation", "margin_mm")}
+        cache_key = result_cache_key(
+            image_id,
+            **geometry,
+            dpi=layout.dpi,
+            style=settings["style"],
+            cell_mm=settings["cell_mm"],
+            preview_size=size,
+            preview_format=image_format,
+        )
+        etag = f'"{cache_key[:32]}"'
+        content_type = "image/png" if image_format == "png" else "image/jpeg"
+        extension = ".png" if image_format == "png" else ".jpg"
+        if self._if_none_match(etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return
+
+        cache = getattr(self.server, "result_cache", None)
+        cached = cache.open(cache_key, extension) if cache is not None else None
+        if cached is not None:
+            with cached:
+                body = cached.read()
+            cache_status = "HIT"
+        else:
+            # Halftone previews draw every mark of the poster, and a source
+            # that is not in memory has to be decoded first, so previews are
+            # priced and admitted like renders.
+            cost = estimate_preview_cost(layout, settings, size, None if source is not None else image_size)
+            gate = getattr(self.server, "render_gate", None)
+            try:
+                check_render_cost(
+                    cost, None, gate.memory_budget if gate is not None else None, self.max_render_seconds
+                )
+            except RenderTooLargeError as exc:
+                self.send_error(413, str(exc))
+                return
+            if not self._admit_render(cost):
+                return
+            try:
+                if source is None:
+                    source = source_cache.get(image_id)
+                    if source is None:
+                        raise ValueError("the uploaded image is no longer available")
+                preview = render_preview(source, layout, size, settings["style"], settings["cell_mm"])
+                body = encode_preview(preview, image_format)
+            except Exception as exc:  # pylint: disable=broad-except
+                self.send_error(400, f"Failed to preview image: {exc}")
+                return
+            finally:
+                self._release_render(cost)
+            if cache is not None:
+                entry = cache.create_entry(cache_key, extension)
+                entry.write(body)
+                entry.commit()
+            cache_status = "MISS"
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "private, max-age=86400")
+        self.send_header("X-Cache", cache_status)
+        self.send_header("X-Poster-DPI", str(layout.dpi))
+        self.send_header("X-Poster-Pages", str(layout.page_count))
+        self.send_header("Server-Timing", self._server_timing())
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_metrics(self) -> None:
+        metrics = getattr(self.server, "metrics", None)
+        if metrics is None:
+            self.send_error(404, "Metrics are not enabled")
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self) -> None:  # noqa: N802 - name required by BaseHTTPRequestHandler
+        path = urlsplit(self.path).path
+        if path.startswith("/results/"):
+            self._send_stored_result(path, include_body=False)
+            return
+        # Only the landing page and stored results answer HEAD; the other
+        # GET routes would do their work just to discard the body.
+        if path.startswith("/jobs/") or path in {"/metrics", "/preview"}:
+            self.send_response(405)
+            self.send_header("Allow", "GET")
+            self.send_header("Content-Length", "0")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return
+        self._send_static(landing_page(), self.page_cache_control, include_body=False)
+
+    def _if_none_match(self, *etags: str) -> bool:
+        """Return True when If-None-Match lists one of `etags`, compared weakly, or is "*"."""
+        header = self.headers.get("If-None-Match")
+        if header is None:
+            return False
+        candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+        return "*" in candidates or not candidates.isdisjoint(etags)
+
+    def _send_static(self, response: StaticResponse, cache_control: str, include_body: bool = True) -> None:
+        coding = negotiate_encoding(self.headers.get("Accept-Encoding", ""), response.variants)
+        etag = response.etag_for(coding)
+
+        if self._if_none_match(*(response.etag_for(name) for name in response.variants)):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            self.send_header("Vary", "Accept-Encoding")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            return
+
+        body = response.variants[coding]
+        self.send_response(200)
+        self.send_header("Content-Type", response.content_type)
+        if coding != "identity":
+            self.send_header("Content-Encoding", coding)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def do_POST(self) -> None:  # noqa: N802 - name required by BaseHTTPRequestHandler
+        if self.path not in {"/rasterbate", "/images", "/jobs"}:
+            self.send_error(404, "Not Found")
+            return
+
+        content_type = self.headers.get("Content-Type", "")
+        if not content_type.startswith("multipart/form-data"):
+            self.send_error(400, "Expected multipart/form-data")
+            return
+
+        content_length = int(self.headers.get("Content-Length", "0"))
+        if content_length <= 0:
+            self.send_error(400, "Missing request body")
+            return
+
+        try:
+            fields, files = parse_multipart_stream(
+                self.rfile,
+                content_type,
+                content_length,
+                max_upload_bytes=self.max_upload_bytes,
+                timeout=self.upload_timeout,
+            )
+        except UploadTooLargeError as exc:
+            self.send_error(413, str(exc))
+            return
+        except (UploadTimeoutError, TimeoutError) as exc:
+            self.send_error(408, str(exc) or "Request body took too long to arrive")
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            self.send_error(400, f"Failed to parse form data: {exc}")
+            return
+
+        metrics = getattr(self.server, "metrics", None)
+        if metrics is not None:
+            for upload in files.values():
+                metrics.observe_upload(upload["size"])
+
+        try:
+            if self.path == "/images":
+                self._store_image(files)
+            elif self.path == "/jobs":
+                self._submit_job(fields, files)
+            else:
+                self._render_result(fields, files)
+        finally:
+            for upload in files.values():
+                upload["file"].close()
+
+    def _store_image(self, files: dict) -> None:
+        source_cache = getattr(self.server, "source_cache", None)
+        if source_cache is None:
+            self.send_error(501, "Image uploads are not enabled")
+            return
+        if "image" not in files:
+            self.send_error(400, "Image upload is required")
+            return
+
+        upload = files["image"]
+        try:
+            cost = estimate_decode_cost(probe_image_size(upload["file"]))
+            gate = getattr(self.server, "render_gate", None)
+            check_render_cost(cost, None, gate.memory_budget if gate is not None else None, self.max_render_seconds)
+        except RenderTooLargeError as exc:
+            self.send_error(413, str(exc))
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            self.send_error(400, f"Failed to decode image: {exc}")
+            return
+        # Decoding is the expensive part of a render, so it waits for room like one.
+        if not self._admit_render(cost):
+            return
+        try:
+            image = source_cache.add(upload["sha256"], upload["file"])
+        except Exception as exc:  # pylint: disable=broad-except
+            self.send_error(400, f"Failed to decode image: {exc}")
+            return
+        finally:
+            self._release_render(cost)
+        self._send_json(201, {"id": upload["sha256"], "width": image.width, "height": image.height})
+
+    def _find_source(self, image_id: str) -> tuple[ImagePyramid | None, tuple[int, int]] | None:
+        """Look up an image uploaded to /images without decoding it.
+
+        Returns (source, size), where `source` is the decoded image when it is
+        in memory and None when only the stored upload is, or None for an
+        unknown or unreadable id. The size comes from the upload's header.
+        """
+        source_cache = getattr(self.server, "source_cache", None)
+        if source_cache is None or not image_id:
+            return None
+        source = source_cache.peek(image_id)
+        if source is not None:
+            return source, source.size
+        encoded = source_cache.open_encoded(image_id)
+        if encoded is None:
+            return None
+        try:
+            with encoded:
+                return None, probe_image_size(encoded)
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+    def _prepare_render(self, fields: dict, files: dict):
+        """Resolve the source image and settings of a render request.
+
+        Returns (image_id, source, settings, layout, cache_key, cost) where
+        `source` is the decoded image when it is in memory and None otherwise,
+        so that any decode waits for admission. `settings` carries the
+        effective DPI and `cost` is the render's `RenderCost`, priced from the
+        image header alone. Sends an error response and returns None when
+        the request cannot be rendered, including with 413 when the poster
+        exceeds the per-request limits.
+        """
+        upload = files.get("image")
+        if upload is not None:
+            image_id = upload["sha256"]
+            source = image_size = None
+        elif fields.get("image_id"):
+            image_id = fields["image_id"]
+            found = self._find_source(image_id)
+            if found is None:
+                self.send_error(404, "Unknown image id; upload the image again")
+                return None
+            source, image_size = found
+        else:
+            self.send_error(400, "Image upload is required")
+            return None
+
+        try:
+            settings = parse_render_settings(fields)
+            width, height = image_size if image_size is not None else probe_image_size(upload["file"])
+            layout = plan_poster_for_settings(width, height, settings)
+            # Priced from the header alone, before anything is decoded.
+            pool = getattr(self.server, "render_pool", None)
+            cost = estimate_render_cost((width, height), layout, settings, pool.workers if pool is not None else None)
+            gate = getattr(self.server, "render_gate", None)
+            check_render_cost(
+                cost,
+                self.max_render_pixels,
+                gate.memory_budget if gate is not None else None,
+                self.max_render_seconds,
+            )
+        except RenderTooLargeError as exc:
+            self.send_error(413, str(exc))
+            return None
+        except Exception as exc:  # pylint: disable=broad-except
+            self.send_error(400, f"Failed to rasterbate image: {exc}")
+            return None
+
+        settings["dpi"] = layout.dpi
+        return image_id, source, settings, layout, result_cache_key(image_id, **settings), cost
+
+    def _render_result(self, fields: dict, files: dict) -> None:
+        prepared = self._prepare_render(fields, files)
+        if prepared is None:
+            return
+        image_id, source, settings, _, cache_key, cost = prepared
+
+        source_cache = getattr(self.server, "source_cache", None)
+        cache = getattr(self.server, "result_cache", None)
+        extension = OUTPUT_FORMATS[settings["output_format"]][1]
+        location = f"/results/{cache_key}{extension}" if cache is not None else None
+        cached = cache.open(cache_key, extension) if cache is not None else None
+        if cached is not None:
+            with cached:
+                size = cached.seek(0, os.SEEK_END)
+                cached.seek(0)
+                self._send_result_headers(
+                    size,
+                    cache_status="HIT",
+                    settings=settings,
+                    server_timing=self._server_timing(),
+                    output_format=settings["output_format"],
+                    content_location=location,
+                )
+                shutil.copyfileobj(cached, self.wfile)
+            return
+
+        if not self._admit_render(cost):
+            return
+
+        chunked = None
+        if self.stream_pdf and self.request_version == "HTTP/1.1":
+            # Headers carry the stages finished before the first byte; the
+            # complete timings follow in a trailer once the PDF is written.
+            chunked = ChunkedResponseWriter(
+                self.wfile,
+                on_start=lambda: self._send_result_headers(
+                    None,
+                    cache_status="MISS",
+                    settings=settings,
+                    server_timing=self._server_timing(total=False),
+                    output_format=settings["output_format"],
+                    content_location=location,
+                ),
+            )
+        buffer = BytesIO() if chunked is None else None
+        entry = cache.create_entry(cache_key, extension) if cache is not None else None
+        output = chunked if chunked is not None else buffer
+        if entry is not None:
+            output = TeeWriter(output, entry)
+
+        metrics = getattr(self.server, "metrics", None)
+        encoded = None
+        try:
+            if settings["compression"] == "passthrough" and settings["output_format"] == "pdf":
+                # Passthrough embeds the original file, so it needs the encoded
+                # upload rather than the decoded pixels.
+                encoded = self._open_encoded_source(image_id, files)
+                source = encoded if encoded is not None else source
+            if source is None and "image" not in files:
+                source = source_cache.get(image_id)
+                if source is None:
+                    raise ValueError("The uploaded image is no longer available.")
+            if source is None:
+                source = files["image"]["file"]
+                if source_cache is not None:
+                    source = source_cache.add(image_id, source)
+            with metrics.track_render() if metrics is not None else nullcontext():
+                rasterbate_image(
+                    source, **settings, output=output, workers=getattr(self.server, "render_pool", None)
+                )
+        except Exception as exc:  # pylint: disable=broad-except
+            if entry is not None:
+                entry.discard()
+            if chunked is not None and chunked.started:
+                # Part of the PDF is already on the wire. Dropping the
+                # connection without the terminating chunk tells the client
+                # that the body is incomplete.
+                self.close_connection = True
+                return
+            self.send_error(400, f"Failed to rasterbate image: {exc}")
+            return
+        finally:
+            if encoded is not None and "image" not in files:
+                encoded.close()
+            self._release_render(cost)
+
+        if entry is not None:
+            entry.commit()
+        if chunked is not None:
+            chunked.close(trailers={"Server-Timing": self._server_timing()})
+            return
+
+        result_bytes = buffer.getbuffer()
+        self._send_result_headers(
+            result_bytes.nbytes,
+            cache_status="MISS",
+            settings=settings,
+            server_timing=self._server_timing(),
+            output_format=settings["output_format"],
+            content_location=location,
+        )
+        self.wfile.write(result_bytes)
+
+    def _admit_render(self, cost: RenderCost) -> bool:
+        """Reserve a per-client slot and room in the render gate, or send 429/503."""
+        limiter = getattr(self.server, "client_limiter", None)
+        if limiter is not None and not limiter.acquire(self._client_key()):
+            self.send_error(429, "Too many renders from this client; wait for one to finish")
+            return False
+        gate = getattr(self.server, "render_gate", None)
+        if gate is not None and not gate.acquire(timeout=self.render_wait_timeout, memory_bytes=cost.memory_bytes):
+            if limiter is not None:
+                limiter.release(self._client_key())
+            self.send_error(503, "Server busy, please try again shortly")
+            return False
+        return True
+
+    def _release_render(self, cost: RenderCost) -> None:
+        gate = getattr(self.server, "render_gate", None)
+        if gate is not None:
+            gate.release(cost.memory_bytes)
+        limiter = getattr(self.server, "client_limiter", None)
+        if limiter is not None:
+            limiter.release(self._client_key())
+
+    def _client_key(self) -> str:
+        """Return the address the per-client limits apply to."""
+        if self.trust_proxy:
+            # Only the last entry was added by our proxy; earlier ones come from the client.
+            forwarded = [entry.strip() for entry in self.headers.get("X-Forwarded-For", "").split(",")]
+            if forwarded[-1]:
+                return forwarded[-1]
+        return self.client_address[0]
+
+    def _open_encoded_source(self, image_id: str, files: dict) -> BinaryIO | None:
+        """Return the encoded image for a render: the upload, or the stored copy."""
+        if "image" in files:
+            upload = files["image"]["file"]
+            upload.seek(0)
+            return upload
+        source_cache = getattr(self.server, "source_cache", None)
+        return source_cache.open_encoded(image_id) if source_cache is not None else None
+
+    def _submit_job(self, fields: dict, files: dict) -> None:
+        jobs = getattr(self.server, "jobs", None)
+        if jobs is None:
+            self.send_error(501, "Background jobs are not enabled")
+            return
+        prepared = self._prepare_render(fields, files)
+        if prepared is None:
+            return
+        image_id, source, settings, layout, cache_key, cost = prepared
+
+        client = self._client_key()
+        limiter = getattr(self.server, "client_limiter", None)
+        if limiter is not None and not limiter.acquire(client):
+            self.send_error(429, "Too many unfinished jobs from this client; wait for one to finish")
+            return
+
+        # The upload is closed when this request ends, so the job needs its own
+        # handle on the image: the source cache's upload store, or a copy.
+        source_cache = getattr(self.server, "source_cache", None)
+        if source is None and "image" in files:
+            upload = files["image"]["file"]
+            if source_cache is None or not source_cache.remember(image_id, upload):
+                upload.seek(0)
+                source = upload.read()
+
+        cache = getattr(self.server, "result_cache", None)
+        extension = OUTPUT_FORMATS[settings["output_format"]][1]
+        metrics = getattr(self.server, "metrics", None)
+        gate = getattr(self.server, "render_gate", None)
+        render_pool = getattr(self.server, "render_pool", None)
+
+        def render(job: RenderJob, output: BinaryIO) -> None:
+            cached = cache.open(cache_key, extension) if cache is not None else None
+            if cached is not None:
+                with cached:
+                    shutil.copyfileobj(cached, output)
+                return
+
+            # Jobs are already queued by the job manager, so they wait for room
+            # in the render gate without counting against its waiting limit.
+            while gate is not None and not gate.acquire(1.0, cost.memory_bytes, limit_waiting=False):
+                if job.cancel_requested.is_set():
+                    raise JobCancelledError()
+            try:
+                encoded = None
+                passthrough = settings["compression"] == "passthrough" and settings["output_format"] == "pdf"
+                if passthrough and not isinstance(source, bytes):
+                    encoded = source_cache.open_encoded(image_id) if source_cache is not None else None
+                if encoded is not None:
+                    image = encoded
+                else:
+                    image = source if source is not None else source_cache.get(image_id)
+                if image is None:
+                    raise ValueError("The uploaded image is no longer available.")
+                entry = cache.create_entry(cache_key, extension) if cache is not None else None
+                try:
+                    tracking = metrics.track_render() if metrics is not None else nullcontext()
+                    with record_stages() as timings, tracking:
+                        rasterbate_image(
+                            image,
+                            **settings,
+                            output=output if entry is None else TeeWriter(output, entry),
+                            workers=render_pool,
+                            progress=job.report_progress,
+                        )
+                    if metrics is not None:
+                        metrics.observe_stages(timings)
+                except BaseException:
+                    if entry is not None:
+                        entry.discard()
+                    raise
+                finally:
+                    if encoded is not None:
+                        encoded.close()
+                if entry is not None:
+                    entry.commit()
+            finally:
+                if gate is not None:
+                    gate.release(cost.memory_bytes)
+
+        job = jobs.submit(render, layout.page_count, settings["output_format"])
+        if job is None:
+            if limiter is not None:
+                limiter.release(client)
+            self.send_error(503, "Too many pending jobs, please try again shortly")
+            return
+        if limiter is not None:
+            # Runs when the job finishes, fails or is cancelled before it starts.
+            job.future.add_done_callback(lambda _: limiter.release(client))
+        self._send_json(202, self._job_state(job), location=f"/jobs/{job.id}")
+
+    @staticmethod
+    def _job_state(job: RenderJob) -> dict:
+        return {**job.to_dict(), "status_url": f"/jobs/{job.id}", "result_url": f"/jobs/{job.id}/result"}
+
+    def _handle_job_get(self, path: str) -> None:
+        jobs = getattr(self.server, "jobs", None)
+        job_id, _, tail = path[len("/jobs/"):].partition("/")
+        job = jobs.get(job_id) if jobs is not None else None
+        if job is None or tail not in {"", "result"}:
+            self.send_error(404, "Unknown or expired job")
+            return
+        if not tail:
+            self._send_json(200, self._job_state(job))
+            return
+        if job.status != "done":
+            self.send_error(409, f"Job is {job.status}")
+            return
+        try:
+            result = open(job.result_path, "rb")
+        except FileNotFoundError:
+            self.send_error(404, "Unknown or expired job")
+            return
+        with result:
+            self._send_download(result, job.output_format, f'"{job.id}"')
+
+    def do_DELETE(self) -> None:  # noqa: N802 - name required by BaseHTTPRequestHandler
+        path = urlsplit(self.path).path
+        jobs = getattr(self.server, "jobs", None)
+        job = jobs.cancel(path[len("/jobs/"):]) if jobs is not None and path.startswith("/jobs/") else None
+        if job is None:
+            self.send_error(404, "Unknown or expired job")
+            return
+        self._send_json(200, self._job_state(job))
+
+    def _send_json(self, status: int, payload: dict, location: str | None = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if location is not None:
+            self.send_header("Location", location)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _server_timing(self, total: bool = True) -> str:
+        elapsed = time.perf_counter() - self._started if total else None
+        return format_server_timing(self._stage_timings, elapsed)
+
+    def _send_result_headers(
+        self,
+        content_length: int | None,
+        cache_status: str | None = None,
+        settings: dict | None = None,
+        server_timing: str | None = None,
+        output_format: str = "pdf",
+        content_location: str | None = None,
+    ) -> None:
+        content_type, extension = OUTPUT_FORMATS[output_format]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if cache_status is not None:
+            self.send_header("X-Cache", cache_status)
+        if settings is not None and output_format == "pdf":
+            compression = describe_compression(settings["compression"], settings["quality"])
+            self.send_header("X-PDF-Compression", compression)
+        if server_timing:
+            self.send_header("Server-Timing", server_timing)
+        if content_length is None:
+            self.send_header("Transfer-Encoding", "chunked")
+            if server_timing is not None:
+                self.send_header("Trailer", "Server-Timing")
+        else:
+            self.send_header("Content-Length", str(content_length))
+        if content_location is not None:
+            # Where the result can be downloaded again, with Range support.
+            self.send_header("Content-Location", content_location)
+        self.send_header("Content-Disposition", f"attachment; filename=poster{extension}")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+    def log_message(self, format: str, *args) -> None:  # noqa: A003 - inherits name from base class
+        return  # Silence default console logging for cleaner output
+
+
+# File extensions picked up when a batch input is a directory.
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tif", ".tiff", ".webp")
+
+
+class BatchItem(NamedTuple):
+    source: str
+    output: str
+
+
+def collect_batch_items(
+    inputs: list[str],
+    output_dir: str | None,
+    recursive: bool = False,
+    extension: str = ".pdf",
+) -> list[BatchItem]:
+    """Map input files and directories to the outputs a batch should write.
+
+    Files inside a directory input keep their relative path under `output_dir`;
+    without `output_dir` each output is written next to its image, named
+    after it with `extension`. An image listed more than once is rendered
+    once. Raises ValueError when two different images would be written to
+    the same output, such as `a/img.jpg` and `b/img.jpg` with `output_dir`,
+    or `img.jpg` and `img.png` side by side.
+    """
+    items = []
+    for path in inputs:
+        if os.path.isdir(path):
+            walk = os.walk(path) if recursive else [(path, [], os.listdir(path))]
+            for directory, _, names in walk:
+                for name in sorted(names):
+                    if name.lower().endswith(BATCH_IMAGE_EXTENSIONS):
+                        source = os.path.join(directory, name)
+                        relative = os.path.relpath(source, path)
+                        items.append(_batch_item(source, relative, output_dir, extension))
+        elif os.path.isfile(path):
+            items.append(_batch_item(path, os.path.basename(path), output_dir, extension))
+        else:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+
+    by_output: dict[str, BatchItem] = {}
+    for item in items:
+        known = by_output.setdefault(os.path.normcase(os.path.abspath(item.output)), item)
+        if os.path.realpath(known.source) != os.path.realpath(item.source):
+            raise ValueError(f"{known.source} and {item.source} would both be written to {item.output}")
+    return list(by_output.values())
+
+
+def _batch_item(source: str, relative: str, output_dir: str | None, extension: str) -> BatchItem:
+    stem = os.path.splitext(relative if output_dir is not None else source)[0] + extension
+    return BatchItem(source, os.path.join(output_dir, stem) if output_dir is not None else stem)
+
+
+def batch_output_is_current(item: BatchItem) -> bool:
+    """Return True when the PDF exists and is newer than its image, as `make` would judge it."""
+    try:
+        return os.stat(item.output).st_mtime >= os.stat(item.source).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def _init_batch_worker(max_source_mp: int) -> None:
+    # Ctrl-C reaches the whole process group; only the parent reacts to it, so
+    # workers finish the image they are on instead of dying half-way.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_max_source_megapixels(max_source_mp)
+
+
+def render_batch_item(item: BatchItem, settings: dict) -> dict:
+    """Render one batch item and return its timings; runs in a pool worker.
+
+    The PDF is written to a `.part` file and renamed into place once complete,
+    so an interrupted batch never leaves a truncated PDF that looks current.
+    """
+    started = time.perf_counter()
+    directory = os.path.dirname(item.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    part_path = item.output + ".part"
+    try:
+        with record_stages() as timings, open(item.source, "rb") as source, open(part_path, "wb") as output:
+            rasterbate_image(source, **settings, output=output)
+        os.replace(part_path, item.output)
+    except Exception as exc:  # pylint: disable=broad-except
+        if os.path.exists(part_path):
+            os.unlink(part_path)
+        return {"source": item.source, "error": str(exc), "seconds": time.perf_counter() - started}
+    return {
+        "source": item.source,
+        "output": item.output,
+        "seconds": time.perf_counter() - started,
+        "bytes": os.path.getsize(item.output),
+        "stages": timings,
+    }
+
+
+def _format_batch_result(result: dict) -> str:
+    if "error" in result:
+        return f"{result['source']}: FAILED after {result['seconds']:.2f}s: {result['error']}"
+    stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in result["stages"].items())
+    return (
+        f"{result['source']} -> {result['output']}: {result['seconds']:.2f}s,"
+        f" {result['bytes'] / 1024:.0f} KB ({stages})"
+    )
+
+
+def batch_main(argv: list[str]) -> int:
+    """Rasterbate image files or directories straight to PDFs, without the HTTP server."""
+    parser = argparse.ArgumentParser(
+        prog="app.py batch",
+        description="Rasterbate many images to one PDF each, skipping PDFs that are already up to date.",
+    )
+    parser.add_argument("inputs", nargs="+", help="image files or directories of images")
+    parser.add_argument("-o", "--output-dir", help="directory for the PDFs (default: next to each image)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="descend into subdirectories")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1, help="images rendered in parallel (default: CPUs)"
+    )
+    parser.add_argument("--force", action="store_true", help="render even when the PDF is newer than the image")
+    parser.add_argument("--columns", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=3)
+    parser.add_argument("--page-size", choices=sorted(PAGE_SIZES_MM), default="A4")
+    parser.add_argument("--orientation", choices=("portrait", "landscape"), default="portrait")
+    parser.add_argument("--margin", type=float, default=10.0, help="margin in millimetres (default: 10)")
+    parser.add_argument("--dpi", type=int, default=-1, help="output DPI (default: chosen from the image)")
+    parser.add_argument("--style", choices=("photo",) + HALFTONE_STYLES, default="photo")
+    parser.add_argument("--cell-mm", type=float, default=HALFTONE_CELL_MM, help="halftone dot size")
+    parser.add_argument("--shared-image", action="store_true", help="embed the photo once per PDF")
+    parser.add_argument("--compression", choices=PDF_COMPRESSIONS, default="jpeg")
+    parser.add_argument("--quality", type=int, default=JPEG_QUALITY, help="JPEG quality, 1-95")
+    parser.add_argument(
+        "--output-format", choices=tuple(OUTPUT_FORMATS), default="pdf", help="PDF, ZIP of page images, or TIFF"
+    )
+    parser.add_argument(
+        "--max-source-mp",
+        type=int,
+        default=MAX_SOURCE_MEGAPIXELS,
+        help=f"largest image accepted, in megapixels (default: {MAX_SOURCE_MEGAPIXELS})",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be positive")
+    if args.max_source_mp < 1:
+        parser.error("--max-source-mp must be positive")
+    if not 1 <= args.quality <= 95:
+        parser.error("--quality must be between 1 and 95")
+
+    settings = {
+        "columns": args.columns,
+        "rows": args.rows,
+        "page_size": args.page_size,
+        "orientation": args.orientation,
+        "margin_mm": args.margin,
+        "dpi": args.dpi,
+        "style": args.style,
+        "cell_mm": args.cell_mm,
+        "shared_image": args.shared_image,
+        "compression": args.compression,
+        "quality": args.quality,
+        "output_format": args.output_format,
+    }
+    try:
+        extension = OUTPUT_FORMATS[args.output_format][1]
+        items = collect_batch_items(args.inputs, args.output_dir, args.recursive, extension)
+    except (FileNotFoundError, ValueError) as exc:
+        parser.error(str(exc))
+    pending = [item for item in items if args.force or not batch_output_is_current(item)]
+    print(f"{len(items)} images, {len(items) - len(pending)} up to date, {len(pending)} to render", flush=True)
+
+    started = time.perf_counter()
+    failures = 0
+    pool = ProcessPoolExecutor(
+        max_workers=min(args.jobs, max(1, len(pending))),
+        initializer=_init_batch_worker,
+        initargs=(args.max_source_mp,),
+    )
+    futures = [pool.submit(render_batch_item, item, settings) for item in pending]
+    try:
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            failures += "error" in result
+            print(f"[{done}/{len(pending)}] {_format_batch_result(result)}", flush=True)
+    except KeyboardInterrupt:
+        # Workers ignore SIGINT, so images already handed to them still finish
+        # and are renamed into place before the process exits; the rest are
+        # cancelled.
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted; run the same command again to resume.", file=sys.stderr)
+        return 130
+    pool.shutdown()
+    print(
+        f"Rendered {len(pending) - failures} of {len(pending)} in {time.perf_counter() - started:.1f}s"
+        + (f", {failures} failed" if failures else ""),
+        flush=True,
+    )
+    return 1 if failures else 0
+
+
+def main(argv: list[str] | None = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["batch"]:
+        sys.exit(batch_main(argv[1:]))
+
+    parser = argparse.ArgumentParser(
+        description="Serve the Rasterbator-style poster generator.",
+        epilog="Run `%(prog)s batch --help` to rasterbate files without the server.",
+    )
+    parser.add_argument("--host", default=HOST, help=f"interface to listen on (default: {HOST})")
+    parser.add_argument("--port", type=int, default=PORT, help=f"port to listen on (default: {PORT})")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=HTTP_WORKERS,
+        help=f"threads handling HTTP connections in each process (default: {HTTP_WORKERS})",
+    )
+    parser.add_argument(
+        "--connection-queue",
+        type=int,
+        default=HTTP_QUEUE,
+        help=f"connections allowed to wait for a free thread before getting 503 (default: {HTTP_QUEUE})",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="server processes sharing the listening socket; above 1, a supervisor forks them (default: 1)",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=0,
+        help="replace a server process after about this many requests, 0 for never (default: 0)",
+    )
+    parser.add_argument(
+        "--render-slots",
+        type=int,
+        default=RENDER_SLOTS,
+        help=f"renders allowed to run at the same time in each server process (default: {RENDER_SLOTS})",
+    )
+    parser.add_argument(
+        "--render-queue",
+        type=int,
+        default=RENDER_QUEUE,
+        help=(
+            "renders allowed to wait for a slot in each server process before requests are rejected"
+            f" (default: {RENDER_QUEUE})"
+        ),
+    )
+    parser.add_argument(
+        "--render-processes",
+        type=int,
+        default=None,
+        help="processes in each server process's render pool (default: render in the request thread)",
+    )
+    parser.add_argument(
+        "--max-render-mp",
+        type=int,
+        default=MAX_RENDER_MEGAPIXELS,
+        help=f"largest poster a request may ask for, in megapixels (default: {MAX_RENDER_MEGAPIXELS})",
+    )
+    parser.add_argument(
+        "--max-render-seconds",
+        type=int,
+        default=MAX_RENDER_SECONDS,
+        help=f"most CPU time a request's render may be estimated to need (default: {MAX_RENDER_SECONDS})",
+    )
+    parser.add_argument(
+        "--max-source-mp",
+        type=int,
+        default=MAX_SOURCE_MEGAPIXELS,
+        help=(
+            f"largest uploaded image accepted, in megapixels (default: {MAX_SOURCE_MEGAPIXELS}); images of"
+            f" {MAP_SOURCE_MEGAPIXELS} or more need about 4 bytes per pixel free in TMPDIR"
+        ),
+    )
+    parser.add_argument(
+        "--render-memory-mb",
+        type=int,
+        default=RENDER_MEMORY_MB,
+        help=(
+            f"estimated memory the running renders of each server process may use together, so"
+            f" --processes N allows N times this in all (default: {RENDER_MEMORY_MB})"
+        ),
+    )
+    parser.add_argument(
+        "--client-renders",
+        type=int,
+        default=CLIENT_RENDERS,
+        help=(
+            "renders and unfinished jobs allowed per client address in each server process, 0 for no limit"
+            " (default: no limit)"
+        ),
+    )
+    parser.add_argument(
+        "--trust-proxy",
+        action="store_true",
+        help="take client addresses from the last X-Forwarded-For entry; only behind a proxy that sets it",
+    )
+    parser.add_argument(
+        "--max-upload-mb",
+        type=int,
+        default=MAX_UPLOAD_BYTES // (1024 * 1024),
+        help=f"largest accepted upload in megabytes (default: {MAX_UPLOAD_BYTES // (1024 * 1024)})",
+    )
+    parser.add_argument(
+        "--upload-timeout",
+        type=int,
+        default=UPLOAD_TIMEOUT_SECONDS,
+        help=f"seconds a client may take to send a request body (default: {UPLOAD_TIMEOUT_SECONDS})",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=CACHE_DIR,
+        help=f"directory for cached PDFs (default: {CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=CACHE_DISK_MB,
+        help=f"disk space for cached PDFs in megabytes, 0 to disable (default: {CACHE_DISK_MB})",
+    )
+    parser.add_argument(
+        "--memory-cache-mb",
+        type=int,
+        default=CACHE_MEMORY_MB,
+        help=(
+            "memory for recently used PDFs in megabytes per server process, 0 to disable"
+            f" (default: {CACHE_MEMORY_MB})"
+        ),
+    )
+    parser.add_argument(
+        "--source-cache-mb",
+        type=int,
+        default=SOURCE_CACHE_MB,
+        help=(
+            "memory for decoded source images and their reductions in megabytes per server process"
+            f" (default: {SOURCE_CACHE_MB})"
+        ),
+    )
+    parser.add_argument(
+        "--job-workers",
+        type=int,
+        default=JOB_WORKERS,
+        help=f"background jobs rendered at the same time (default: {JOB_WORKERS})",
+    )
+    parser.add_argument(
+        "--job-ttl",
+        type=int,
+        default=JOB_TTL_SECONDS,
+        help=f"seconds finished job results are kept (default: {JOB_TTL_SECONDS})",
+    )
+    args = parser.parse_args(argv)
+
+    if args.workers < 1 or args.render_slots < 1 or args.render_queue < 0 or args.job_workers < 1:
+        parser.error(
+            "--workers, --render-slots and --job-workers must be positive and --render-queue cannot be negative"
+        )
+    if args.render_slots + args.render_queue >= args.workers:
+        parser.error("--render-slots plus --render-queue must be smaller than --workers")
+    if args.max_render_mp < 1 or args.max_render_seconds < 1 or args.render_memory_mb < 1 or args.max_source_mp < 1:
+        parser.error("--max-render-mp, --max-render-seconds, --render-memory-mb and --max-source-mp must be positive")
+    if args.client_renders < 0 or args.connection_queue < 0 or args.upload_timeout < 1:
+        parser.error("--client-renders and --connection-queue cannot be negative and --upload-timeout must be positive")
+    if args.processes < 1 or args.max_requests < 0:
+        parser.error("--processes must be positive and --max-requests cannot be negative")
+    prefork = args.processes > 1 or args.max_requests > 0
+    if prefork and not hasattr(os, "fork"):
+        parser.error("--processes and --max-requests need a platform with fork()")
+
+    landing_page()  # render and compress the page once, before taking traffic
+    set_max_source_megapixels(args.max_source_mp)
+    RasterbatorHandler.max_upload_bytes = args.max_upload_mb * 1024 * 1024
+    RasterbatorHandler.upload_timeout = args.upload_timeout
+    RasterbatorHandler.max_render_pixels = args.max_render_mp * 1_000_000
+    RasterbatorHandler.max_render_seconds = args.max_render_seconds
+    RasterbatorHandler.trust_proxy = args.trust_proxy
+    jobs_dir = os.path.join(args.cache_dir, "jobs")
+
+    def make_server(listen_socket: socket.socket | None = None) -> BoundedThreadingHTTPServer:
+        # Each process builds its own caches, pools and metrics, after any fork.
+        max_requests = args.max_requests
+        if max_requests:
+            # Up to 10% more, so that processes started together are not all replaced together.
+            max_requests += secrets.randbelow(max_requests // 10 + 1)
+        return BoundedThreadingHTTPServer(
+            (args.host, args.port),
+            RasterbatorHandler,
+            workers=args.workers,
+            render_gate=RenderGate(args.render_slots, args.render_queue, args.render_memory_mb * 1024 * 1024),
+            result_cache=ResultCache(
+                args.cache_dir,
+                max_disk_bytes=args.cache_size_mb * 1024 * 1024,
+                max_memory_bytes=args.memory_cache_mb * 1024 * 1024,
+            ),
+            source_cache=SourceCache(
+                args.source_cache_mb * 1024 * 1024,
+                store=ResultCache(
+                    os.path.join(args.cache_dir, "uploads"),
+                    max_disk_bytes=args.cache_size_mb * 1024 * 1024,
+                    max_memory_bytes=0,
+                    suffixes=(".img",),
+                ),
+            ),
+            jobs=JobManager(jobs_dir, workers=args.job_workers, result_ttl=args.job_ttl, shared=prefork),
+            metrics=Metrics(),
+            client_limiter=ClientLimiter(args.client_renders) if args.client_renders else None,
+            listen_socket=listen_socket,
+            max_requests=max_requests,
+            max_queued=args.connection_queue,
+            render_pool=RenderPool(args.render_processes) if (args.render_processes or 0) > 1 else None,
+        )
+
+    if prefork:
+        JobManager.remove_orphans(jobs_dir)
+        listen_socket = socket.create_server(
+            (args.host, args.port),
+            backlog=BoundedThreadingHTTPServer.request_queue_size,
+            reuse_port=hasattr(socket, "SO_REUSEPORT"),
+        )
+        # All processes wait on the socket, and those that lose the race for a
+        # connection must not block in accept().
+        listen_socket.setblocking(False)
+
+        def serve(listen_socket: socket.socket) -> None:
+            server = make_server(listen_socket)
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+
+        print(f"Rasterbator-style site running at http://{args.host}:{args.port} in {args.processes} processes")
+        try:
+            PreforkSupervisor(listen_socket, args.processes, serve).run()
+        finally:
+            listen_socket.close()
+        return
+    server = make_server()
+    # Let the server close cleanly, taking its render processes with it.
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    print(f"Rasterbator-style site running at http://{args.host}:{args.port}")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
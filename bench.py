@@ -0,0 +1,449 @@
+"""Benchmarks for the rasterbation pipeline and the HTTP server.
+
+Run `python bench.py --help` for the available suites. Results are written as
+JSON so that two runs can be compared with `python bench.py compare`.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+
+import app
+
+DEFAULT_SIZES = "1200x900,3000x2000"
+DEFAULT_GRIDS = "1x1,3x3"
+DEFAULT_DPIS = "auto,150"
+DEFAULT_PAGE_SIZES = "A4,Letter"
+DEFAULT_ORIENTATIONS = "portrait,landscape"
+
+
+def synthetic_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """Return a reproducible photo-like JPEG: smooth gradients with seeded grain."""
+    from PIL import Image  # type: ignore
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    grain = Image.frombytes("L", (width, height), random.Random(seed).randbytes(width * height))
+    image = Image.merge("RGB", (gradient, radial, Image.blend(gradient, grain, 0.3)))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+class _CountingSink:
+    """Write-only stream that discards the PDF and keeps its size."""
+
+    def __init__(self) -> None:
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def run_case(case: dict) -> dict:
+    """Render one benchmark case in this process and return its measurements."""
+    with open(case["image_path"], "rb") as handle:
+        image_bytes = handle.read()
+    wall_times = []
+    stage_runs = []
+    for _ in range(case["repeat"]):
+        sink = _CountingSink()
+        started = time.perf_counter()
+        with app.record_stages() as stages:
+            app.rasterbate_image(
+                image_bytes,
+                columns=case["columns"],
+                rows=case["rows"],
+                page_size=case["page_size"],
+                orientation=case["orientation"],
+                margin_mm=10.0,
+                dpi=case["dpi"],
+                output=sink,
+                workers=case["workers"],
+            )
+        wall_times.append(time.perf_counter() - started)
+        stage_runs.append(stages)
+    # Stage timings are medians across repeats, like wall_seconds_median.
+    names = dict.fromkeys(name for stages in stage_runs for name in stages)
+    return {
+        "wall_seconds": min(wall_times),
+        "wall_seconds_median": statistics.median(wall_times),
+        "stages": {name: statistics.median(stages.get(name, 0.0) for stages in stage_runs) for name in names},
+        "peak_rss_bytes": peak_rss_bytes(),
+        "pdf_bytes": sink.size,
+    }
+
+
+def pipeline_cases(args, image_dir: str):
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    grids = [parse_size(grid) for grid in args.grids.split(",")]
+    dpis = args.dpis.split(",")
+    matrix = itertools.product(sizes, grids, dpis, args.page_sizes.split(","), args.orientations.split(","))
+    for (width, height), (columns, rows), dpi, page_size, orientation in matrix:
+        yield {
+            "name": f"{width}x{height} {columns}x{rows} {dpi}dpi {page_size} {orientation}",
+            "image_path": os.path.join(image_dir, f"{width}x{height}.jpg"),
+            "columns": columns,
+            "rows": rows,
+            "dpi": -1 if dpi == "auto" else int(dpi),
+            "page_size": page_size,
+            "orientation": orientation,
+            "repeat": args.repeat,
+            "workers": args.render_processes,
+        }
+
+
+def bench_pipeline(args) -> list[dict]:
+    """Run every case of the sweep in its own process so peak RSS is per case."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix="rasterbator-bench-") as image_dir:
+        for size in args.sizes.split(","):
+            with open(os.path.join(image_dir, f"{size}.jpg"), "wb") as handle:
+                handle.write(synthetic_jpeg(*parse_size(size)))
+        for case in pipeline_cases(args, image_dir):
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "_case", json.dumps(case)],
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            if completed.returncode != 0:
+                result = {"error": completed.stderr.strip().splitlines()[-1:]}
+            else:
+                result = json.loads(completed.stdout)
+            case.pop("image_path")
+            results.append({**case, **result})
+            if "error" in result:
+                print(f"  {case['name']}: failed: {result['error']}", file=sys.stderr)
+            else:
+                print(
+                    f"  {case['name']}: {result['wall_seconds']:.3f}s,"
+                    f" {result['peak_rss_bytes'] / 2**20:.0f} MB peak, {result['pdf_bytes'] / 1024:.0f} KB",
+                    file=sys.stderr,
+                )
+    return results
+
+
+def _best_of(statement, number: int, repeat: int = 5) -> float:
+    return min(timeit.repeat(statement, number=number, repeat=repeat)) / number
+
+
+def bench_micro(args) -> list[dict]:
+    """Time the small, hot helpers in-process."""
+    results = []
+    for size in args.sizes.split(","):
+        image = synthetic_jpeg(*parse_size(size))
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"columns\"\r\n\r\n3\r\n"
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.jpg\"\r\n"
+            "Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + image + f"\r\n--{boundary}--\r\n".encode()
+        content_type = f"multipart/form-data; boundary={boundary}"
+        seconds = _best_of(lambda: app.parse_multipart_form(body, content_type), number=5)
+        results.append({"name": f"parse_multipart_form {size}", "body_bytes": len(body), "seconds": seconds})
+    seconds = _best_of(lambda: app.suggest_dpi(3000, 2000, 3, 3, 210, 297, 10), number=10000)
+    results.append({"name": "suggest_dpi", "seconds": seconds})
+    for result in results:
+        print(f"  {result['name']}: {result['seconds'] * 1e6:.1f} us", file=sys.stderr)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 15.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("server did not start listening")
+
+
+def _request(port: int, method: str, path: str, body: bytes | None = None, headers: dict | None = None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    try:
+        started = time.perf_counter()
+        connection.request(method, path, body=body, headers=headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def _run_phase(count: int, concurrency: int, send) -> dict:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, range(count)))
+    elapsed = time.perf_counter() - started
+    # Rejected or failed requests return quickly, so throughput and latency
+    # only count successful responses; the rest show up in the error rate.
+    latencies = [latency for status, latency in outcomes if 200 <= status < 300]
+    statuses = Counter(str(status) for status, _ in outcomes)
+    summary = {
+        "requests": count,
+        "concurrency": concurrency,
+        "errors": count - len(latencies),
+        "error_rate": (count - len(latencies)) / count if count else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        "seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+    }
+    if latencies:
+        summary.update(
+            p50_seconds=percentile(latencies, 0.50),
+            p99_seconds=percentile(latencies, 0.99),
+            mean_seconds=statistics.fmean(latencies),
+        )
+    return summary
+
+
+def bench_load(args) -> dict:
+    """Start the server locally and measure GET and POST latency under concurrency."""
+    port = _free_port()
+    image = synthetic_jpeg(*parse_size(args.load_image))
+    fields = {"columns": "2", "rows": "2", "page_size": "A4", "orientation": "portrait", "dpi": "150"}
+    boundary = uuid.uuid4().hex
+
+    def post_body(index: int) -> bytes:
+        # Bytes after the JPEG end marker are ignored by decoders but change the
+        # upload digest, so every request misses the result cache unless asked.
+        payload = image if args.cached else image + index.to_bytes(8, "big")
+        parts = [
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode()
+            for name, value in fields.items()
+        ]
+        parts.append(
+            f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n".encode()
+            + payload
+            + f"\r\n--{boundary}--\r\n".encode()
+        )
+        return b"".join(parts)
+
+    post_headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    with tempfile.TemporaryDirectory(prefix="rasterbator-bench-cache-") as cache_dir:
+        command = [
+            sys.executable,
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"),
+            "--host", "127.0.0.1",
+            "--port", str(port),
+            "--cache-dir", cache_dir,
+            # Every bench client connects from 127.0.0.1, so a per-client
+            # limit would turn most concurrent POSTs into 429s.
+            "--client-renders", "0",
+            *args.server_args,
+        ]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_port(port)
+            get = _run_phase(
+                args.get_requests,
+                args.concurrency,
+                lambda index: _request(port, "GET", "/", headers={"Accept-Encoding": "gzip"}),
+            )
+            post = _run_phase(
+                args.post_requests,
+                args.concurrency,
+                lambda index: _request(port, "POST", "/rasterbate", post_body(index), post_headers),
+            )
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    for method, summary in (("GET", get), ("POST", post)):
+        statuses = ", ".join(f"{count} x {status}" for status, count in summary["statuses"].items())
+        if "p50_seconds" in summary:
+            print(
+                f"  {method}: {summary['throughput_rps']:.1f} successful req/s,"
+                f" p50 {summary['p50_seconds'] * 1000:.1f} ms, p99 {summary['p99_seconds'] * 1000:.1f} ms,"
+                f" {summary['error_rate']:.0%} errors ({statuses})",
+                file=sys.stderr,
+            )
+        else:
+            print(f"  {method}: all {summary['requests']} requests failed ({statuses})", file=sys.stderr)
+    return {"image": args.load_image, "cached": args.cached, "get": get, "post": post}
+
+
+def environment() -> dict:
+    from PIL import __version__ as pillow_version  # type: ignore
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pillow": pillow_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Measurements compared between runs, per result section; lower is better for all of them.
+_COMPARED = {
+    "pipeline": ("wall_seconds", "peak_rss_bytes", "pdf_bytes"),
+    "micro": ("seconds",),
+}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> int:
+    """Print the relative change of every shared measurement; return the regression count."""
+    regressions = 0
+    rows = []
+    error_rows = []
+    for section, keys in _COMPARED.items():
+        before = {entry["name"]: entry for entry in baseline.get(section, [])}
+        for entry in current.get(section, []):
+            old = before.get(entry["name"])
+            if old is None:
+                continue
+            for key in keys:
+                if key in old and key in entry and old[key]:
+                    rows.append((f"{section}: {entry['name']}", key, old[key], entry[key]))
+    for method in ("get", "post"):
+        old = baseline.get("load", {}).get(method, {})
+        new = current.get("load", {}).get(method, {})
+        for key in ("p50_seconds", "p99_seconds"):
+            if old.get(key) and key in new:
+                rows.append((f"load: {method.upper()}", key, old[key], new[key]))
+        if new.get("error_rate", 0.0) > old.get("error_rate", 0.0):
+            error_rows.append((f"load: {method.upper()}", old.get("error_rate", 0.0), new["error_rate"]))
+
+    for name, key, old, new in rows:
+        change = (new - old) / old * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:60} {key:20} {old:>14.6g} -> {new:<14.6g} {change:+7.1f}%{flag}")
+    for name, old, new in error_rows:
+        # A rate that starts at zero has no relative change, so any increase counts.
+        regressions += 1
+        print(f"{name:60} {'error_rate':20} {old:>14.6g} -> {new:<14.6g}          REGRESSION")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["_case"]:
+        print(json.dumps(run_case(json.loads(argv[1]))))
+        return 0
+
+    parser = argparse.ArgumentParser(description="Benchmark the Rasterbator-style poster generator.")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="run benchmark suites and save the results (default)")
+    run.add_argument(
+        "--suite",
+        action="append",
+        choices=("pipeline", "micro", "load"),
+        help="suite to run; repeat for several (default: all)",
+    )
+    run.add_argument("--output", default="bench-results.json", help="where to write the JSON results")
+    run.add_argument("--sizes", default=DEFAULT_SIZES, help=f"source image sizes (default: {DEFAULT_SIZES})")
+    run.add_argument("--grids", default=DEFAULT_GRIDS, help=f"columns x rows to sweep (default: {DEFAULT_GRIDS})")
+    run.add_argument("--dpis", default=DEFAULT_DPIS, help=f"DPIs to sweep, or auto (default: {DEFAULT_DPIS})")
+    run.add_argument("--page-sizes", default=DEFAULT_PAGE_SIZES, help=f"(default: {DEFAULT_PAGE_SIZES})")
+    run.add_argument("--orientations", default=DEFAULT_ORIENTATIONS, help=f"(default: {DEFAULT_ORIENTATIONS})")
+    run.add_argument(
+        "--repeat", type=int, default=1, help="renders per case; the fastest and the median are reported"
+    )
+    run.add_argument("--render-processes", type=int, default=None, help="processes used for each render")
+    run.add_argument("--load-image", default="1200x900", help="image size posted by the load test")
+    run.add_argument("--get-requests", type=int, default=500, help="GET requests in the load test")
+    run.add_argument("--post-requests", type=int, default=20, help="POST requests in the load test")
+    run.add_argument("--concurrency", type=int, default=4, help="concurrent clients in the load test")
+    run.add_argument("--cached", action="store_true", help="post the same image so renders hit the cache")
+    run.add_argument(
+        "--server-arg",
+        dest="server_args",
+        action="append",
+        default=[],
+        help="extra argument for app.py in the load test, e.g. --server-arg=--render-slots=4",
+    )
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--threshold", type=float, default=10.0, help="percent slowdown reported as a regression")
+
+    # `run` is the default command, so its options can be given without it.
+    if argv[:1] not in (["run"], ["compare"], ["-h"], ["--help"]):
+        argv = ["run", *argv]
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        with open(args.current, encoding="utf-8") as handle:
+            current = json.load(handle)
+        return 1 if compare(baseline, current, args.threshold) else 0
+
+    suites = args.suite or ["pipeline", "micro", "load"]
+    results = {"environment": environment()}
+    for suite in suites:
+        print(f"{suite}:", file=sys.stderr)
+        results[suite] = {"pipeline": bench_pipeline, "micro": bench_micro, "load": bench_load}[suite](args)
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())